@@ -118,7 +118,10 @@ CORS_ALLOW_HEADERS = [
     'user-agent',
     'x-csrftoken',
     'x-requested-with',
+    'if-none-match',
 ]
+# Read by the frontend for long-polling job status and retrying analyses still running
+CORS_EXPOSE_HEADERS = ['etag', 'retry-after']
 
 FILE_UPLOAD_MAX_MEMORY_SIZE = 10485760  # 10MB
 
@@ -129,9 +132,106 @@ PASSPORT_PHOTO_SETTINGS = {
     'OUTPUT_QUALITY': 95,
     'OUTPUT_DPI': 300,
     
+    # Load models and run a dummy inference at startup; /health/ reports not-ready until this finishes
+    'WARM_UP_ON_STARTUP': os.getenv('WARM_UP_ON_STARTUP', 'True').lower() == 'true',
+    
+    # Background job execution: at most this many photos are processed at once, the rest wait in FIFO order
+    'MAX_CONCURRENT_JOBS': int(os.getenv('MAX_CONCURRENT_JOBS', '2')),
+    
+    # Job queue: 'thread' runs jobs inside the web process, 'database' leaves them for `manage.py run_photo_workers`
+    'JOB_QUEUE': {
+        'BACKEND': os.getenv('JOB_QUEUE_BACKEND', 'thread'),
+        'LEASE_SECONDS': 300,          # A worker that stops renewing its lease for this long is presumed dead
+        'MAX_ATTEMPTS': 3,             # Jobs whose lease expired this many times are marked failed
+        'POLL_INTERVAL_SECONDS': 1.0,  # Idle worker sleep between queue polls
+        'WORKER_PROCESSES': int(os.getenv('PHOTO_WORKER_PROCESSES', '1')),
+    },
+    
     # Background Removal Configuration
     'BACKGROUND_REMOVAL_MODEL': 'birefnet-portrait',  # Options: 'u2net' (default), 'isnet-general-use', 'birefnet-portrait' (best quality), 'u2netp' (fast), 'u2net-human-seg' (optimized for humans)
     
+    # Micro-batching of concurrent BiRefNet requests into one ONNX forward pass.
+    # A longer wait window gives bigger batches (throughput); 0 dispatches immediately (latency).
+    # Off by default: every request pays the wait window, which only pays off on a GPU under concurrent load.
+    'BACKGROUND_REMOVAL_BATCHING': {
+        'ENABLED': os.getenv('BG_BATCHING_ENABLED', 'False').lower() == 'true',
+        'MAX_BATCH_SIZE': int(os.getenv('BG_BATCH_MAX_SIZE', '4')),
+        'MAX_WAIT_MS': float(os.getenv('BG_BATCH_MAX_WAIT_MS', '15')),
+    },
+    
+    # Run the background model on a downscaled proxy and upsample only the alpha mask.
+    # BiRefNet predicts at 1024px internally, so the proxy loses no mask detail.
+    'BACKGROUND_REMOVAL_PROXY': {
+        'ENABLED': os.getenv('BG_PROXY_ENABLED', 'True').lower() == 'true',
+        'MAX_DIMENSION': 1024,  # Long edge of the proxy image fed to the model
+        'REFINE_EDGES': True,   # Guided-filter the upsampled alpha against the full-resolution image
+        'REFINE_RADIUS': 8,     # Guided filter window radius in working-resolution pixels
+        'REFINE_EPS': 1e-3,     # Guided filter regularisation (higher = smoother, less edge-following)
+    },
+    
+    # Disk cache of background-removal masks, addressed by a hash of the decoded image, model and pipeline version
+    'MASK_CACHE': {
+        'ENABLED': os.getenv('MASK_CACHE_ENABLED', 'True').lower() == 'true',
+        'DIRECTORY': os.getenv('MASK_CACHE_DIR', str(BASE_DIR / 'cache' / 'masks')),
+        'MAX_SIZE_MB': int(os.getenv('MASK_CACHE_MAX_SIZE_MB', '512')),  # Least recently used masks are evicted above this
+    },
+    
+    # Country list cache: rebuilt in-process on Country changes, shareable by nginx or a CDN
+    'COUNTRY_LIST': {
+        'CACHE_SECONDS': 60,     # Bounds how long other processes serve a list edited elsewhere
+        'MAX_AGE_SECONDS': 300,  # Cache-Control max-age for browsers and shared caches
+    },
+    
+    # Job status polling: clients poll with If-None-Match and get 304 while nothing changed. A
+    # server-side hold (?wait=) is opt-in, since every held request occupies a web worker thread
+    'JOB_STATUS': {
+        'MAX_WAIT_SECONDS': float(os.getenv('JOB_STATUS_MAX_WAIT_SECONDS', '0')),  # Longest hold; 0 answers at once
+        'CHECK_INTERVAL_SECONDS': 1.0,  # Row check while holding a job processed by another process
+    },
+    
+    # Prepared photos (semi-auto mode) are kept server-side under a token until generate_photo uses them
+    'PREPARED_SESSIONS': {
+        'DIRECTORY': os.getenv('PREPARED_SESSION_DIR', str(BASE_DIR / 'cache' / 'prepared')),
+        'TTL_SECONDS': int(os.getenv('PREPARED_SESSION_TTL_SECONDS', '1800')),
+        'IMAGE_FORMAT': os.getenv('PREPARED_IMAGE_FORMAT', 'webp'),  # 'webp' (compact, with alpha) or 'png'
+        'PREVIEW_MAX_DIMENSION': int(os.getenv('PREPARED_PREVIEW_MAX_DIMENSION', '1280')),  # Long edge of the editor preview
+    },
+    
+    # Skip the background model when the photo was already shot against a plain light backdrop.
+    # Thresholds are strict on purpose: anything doubtful goes through the model.
+    'UNIFORM_BACKDROP': {
+        'ENABLED': os.getenv('UNIFORM_BACKDROP_ENABLED', 'False').lower() == 'true',  # Opt-in shortcut
+        'BORDER_RATIO': 0.06,           # Width of the border strips sampled, relative to the short edge
+        'TOLERANCE': 18.0,              # RGB distance from the backdrop colour still counted as backdrop
+        'MIN_COVERAGE': 0.98,           # Share of border pixels that must be within tolerance
+        'MIN_BRIGHTNESS': 200.0,        # Backdrop must already be white / light grey
+        'MAX_TINT': 20.0,               # Max spread between RGB channels of the backdrop colour
+        'MAX_GRADIENT': 6.0,            # Max luminance difference between border segments (falloff, shadows)
+        'FOREGROUND_RANGE': (0.1, 0.85),  # Plausible share of the frame taken by the subject
+        'MIN_SHOULDER_RATIO': 0.3,      # Share of the bottom row the subject must cover
+        'MAX_EDGE_CONTACT': 0.0,        # Share of the top row and upper sides the subject may touch
+        'MAX_SHADOW_RATIO': 0.002,      # Share of the frame backdrop-coloured shadows may take
+    },
+    
+    # Pipeline order for automatic mode:
+    #   'sequential' - remove the background from the whole frame, then detect the face
+    #   'face_first' - detect the face on the original, then remove the background only from the output crop
+    #   'concurrent' - detect the face on the original while the background model runs on the whole frame
+    'PIPELINE_MODE': os.getenv('PIPELINE_MODE', 'sequential'),
+    'ROI_MARGIN': 0.1,  # Extra context around the face-first crop, as a fraction of its size
+    'STAGE_POOL_WORKERS': 4,  # Threads running face detection alongside background removal
+    
+    # Pre-flight checks on a small copy of the photo, run before background removal.
+    # Thresholds are deliberately lenient: only clearly unusable photos are rejected.
+    'PREFLIGHT': {
+        'ENABLED': os.getenv('PREFLIGHT_ENABLED', 'False').lower() == 'true',  # Opt-in until tuned on real uploads
+        'MAX_DIMENSION': 640,           # Long edge of the copy all checks run on
+        'MULTI_FACE_CONFIDENCE': 0.6,   # Only faces this confident count towards "multiple faces"
+        'MIN_SHARPNESS': 15.0,          # Variance of the Laplacian; sharp portraits are typically > 100
+        'MIN_BRIGHTNESS': 30.0,         # Mean gray level (0-255)
+        'MAX_BRIGHTNESS': 240.0,
+    },
+    
     # Face Detection Configuration
     'YOLO_FACE_MODEL_PATH': os.path.join(BASE_DIR, 'tmp', 'yolov8n-face.pt'),  # YapaLab YOLO-face model location
     'HEAD_EXPANSION': {
@@ -139,9 +239,21 @@ PASSPORT_PHOTO_SETTINGS = {
         'OPENCV_HAAR': 1.3,  # Expansion ratio for OpenCV Haar Cascade detection
         'YOLO_PERSON': 0.28, # Head height ratio for YOLO person detection fallback
     },
+    # Adaptive YOLO inference: try the small size first, escalate only when no face reaches the confidence
+    'YOLO_INFERENCE_SIZES': [320, 640],
+    'YOLO_ESCALATE_CONFIDENCE': 0.5,
+    'HAAR_MAX_DIMENSION': 800,  # OpenCV fallback runs on a grayscale copy downscaled to this long edge
     'FACE_DETECTION_CONFIDENCE': {
         'YOLO_FACE': 0.3,    # Minimum confidence for YapaLab YOLO-face (lower = more permissive)
         'OPENCV_HAAR': 0.5,  # Minimum confidence equivalent for OpenCV
         'YOLO_PERSON': 0.5,  # Minimum confidence for YOLO person detection
     },
+    
+    # Batching of concurrent YOLO face detection requests into one ultralytics predict call.
+    # Off by default, like background-removal batching: it only helps on a GPU under concurrent load.
+    'FACE_DETECTION_BATCHING': {
+        'ENABLED': os.getenv('FACE_BATCHING_ENABLED', 'False').lower() == 'true',
+        'MAX_BATCH_SIZE': int(os.getenv('FACE_BATCH_MAX_SIZE', '8')),
+        'MAX_WAIT_MS': float(os.getenv('FACE_BATCH_MAX_WAIT_MS', '5')),
+    },
 }
\ No newline at end of file
@@ -4,4 +4,12 @@ from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ai_tools.settings')
 
-application = get_wsgi_application()
\ No newline at end of file
+application = get_wsgi_application()
+
+# Warm up inference models in the background so /health/ turns ready before real traffic arrives;
+# servers that don't load this module are covered by the health check starting warm-up itself
+from django.conf import settings
+
+if settings.PASSPORT_PHOTO_SETTINGS.get('WARM_UP_ON_STARTUP', False):
+    from passport_photo.model_registry import start_warm_up
+    start_warm_up()
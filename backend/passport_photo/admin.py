@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Country, PhotoProcessingJob
+from .models import Country, PhotoProcessingJob, PhotoOutput
 
 @admin.register(Country)
 class CountryAdmin(admin.ModelAdmin):
@@ -8,9 +8,16 @@ class CountryAdmin(admin.ModelAdmin):
     search_fields = ['name', 'code']
     ordering = ['name']
 
+class PhotoOutputInline(admin.TabularInline):
+    model = PhotoOutput
+    extra = 0
+    readonly_fields = ['created_at']
+
 @admin.register(PhotoProcessingJob)
 class PhotoProcessingJobAdmin(admin.ModelAdmin):
-    list_display = ['id', 'country', 'status', 'created_at', 'expires_at']
-    list_filter = ['status', 'created_at', 'country']
+    inlines = [PhotoOutputInline]
+    list_display = ['id', 'kind', 'country', 'status', 'created_at', 'expires_at']
+    list_select_related = ['country']
+    list_filter = ['kind', 'status', 'created_at', 'country']
     readonly_fields = ['id', 'created_at', 'updated_at']
     ordering = ['-created_at']
\ No newline at end of file
@@ -2,4 +2,13 @@ from django.apps import AppConfig
 
 class PassportPhotoConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'passport_photo'
\ No newline at end of file
+    name = 'passport_photo'
+    
+    def ready(self):
+        # Country edits in the admin must not be hidden behind the cached country list
+        from django.db.models.signals import post_save, post_delete
+        from .country_cache import invalidate_country_cache
+        from .models import Country
+        post_save.connect(invalidate_country_cache, sender=Country, dispatch_uid='country_cache_save')
+        post_delete.connect(invalidate_country_cache, sender=Country, dispatch_uid='country_cache_delete')
+
@@ -0,0 +1,98 @@
+import cv2
+import numpy as np
+
+# ITU-R BT.601 luma weights
+LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+def analyze_backdrop(image, border_ratio=0.06, tolerance=18.0):
+    """Colour statistics of the top and upper-side border strips of an RGB image
+
+    The bottom edge and the lower half of the sides are skipped: in a portrait they are usually
+    the subject's shoulders, not the backdrop. 'gradient' is the luminance range between segments
+    of the strips; a lighting falloff or a shadow on the wall can stay within the colour tolerance
+    everywhere and still show up there.
+    """
+    array = np.asarray(image, dtype=np.float32)
+    height, width = array.shape[:2]
+    strip = max(1, int(round(min(height, width) * border_ratio)))
+    upper = max(strip, height // 2)
+
+    strips = [array[:strip], array[:upper, :strip], array[:upper, -strip:]]
+    pixels = np.concatenate([region.reshape(-1, 3) for region in strips])
+    color = np.median(pixels, axis=0)
+    distance = np.linalg.norm(pixels - color, axis=1)
+
+    # Median luminance of eight segments along the top strip and four down each side strip
+    segments = np.array_split(strips[0], 8, axis=1) + np.array_split(strips[1], 4) + np.array_split(strips[2], 4)
+    segment_luma = [float(np.median(segment.reshape(-1, 3) @ LUMA)) for segment in segments if segment.size]
+
+    return {
+        'color': tuple(float(c) for c in color),
+        'brightness': float(color.mean()),
+        'tint': float(color.max() - color.min()),
+        'coverage': float(np.mean(distance <= tolerance)),
+        'gradient': float(max(segment_luma) - min(segment_luma)),
+    }
+
+
+def backdrop_mask(image, color, tolerance=18.0, feather=3):
+    """Threshold segmentation of a uniform backdrop
+
+    Backdrop-coloured pixels only count as background when they are connected to the top or side
+    border, so a white collar enclosed by the silhouette stays opaque. Within feather pixels of the
+    silhouette the alpha follows the colour difference from the backdrop, so hair gets a matte
+    rather than a cut-out edge.
+
+    Returns (uint8 alpha mask, stats). The stats are all shares of frame pixels: 'foreground'
+    (the whole frame), 'shoulders' (the bottom row; low means backdrop-coloured clothing was
+    flooded as background) and 'edge_contact' (the top row and upper sides, where nothing but
+    backdrop belongs). 'shadow' is the share of the frame taken by backdrop-coloured but darker
+    regions next to the backdrop, i.e. shadows that the threshold would keep opaque.
+    """
+    array = np.asarray(image, dtype=np.float32)
+    height = array.shape[0]
+    color = np.asarray(color, dtype=np.float32)
+    distance = np.linalg.norm(array - color, axis=2)
+    candidate = (distance <= tolerance).astype(np.uint8)
+
+    _, labels = cv2.connectedComponents(candidate, connectivity=4)
+    border_labels = np.unique(np.concatenate([labels[0], labels[:, 0], labels[:, -1]]))
+    border_labels = border_labels[border_labels > 0]
+    background = np.isin(labels, border_labels)
+    foreground = ~background
+
+    kernel = np.ones((2 * feather + 1, 2 * feather + 1), dtype=np.uint8)
+    near_background = cv2.dilate(background.astype(np.uint8), kernel).astype(bool)
+    band = near_background & cv2.dilate(foreground.astype(np.uint8), kernel).astype(bool)
+
+    alpha = foreground.astype(np.float32)
+    soft = np.clip((distance - tolerance * 0.5) / (tolerance * 2.5), 0.0, 1.0)
+    alpha[band] = soft[band]
+    mask = np.round(alpha * 255).astype(np.uint8)
+
+    # Shadows keep the backdrop's chromaticity but are darker; skin, hair and most clothing don't
+    chroma = array / np.maximum(array.sum(axis=2, keepdims=True), 1.0)
+    backdrop_chroma = color / max(float(color.sum()), 1.0)
+    luma = array @ LUMA
+    backdrop_luma = float(color @ LUMA)
+    shadow_like = (
+        foreground
+        & (np.abs(chroma - backdrop_chroma).max(axis=2) < 0.015)
+        & (luma >= backdrop_luma * 0.5)
+    ).astype(np.uint8)
+    # Opening drops the thin anti-aliased ring along every silhouette, which is also backdrop-coloured
+    shadow_like = cv2.morphologyEx(shadow_like, cv2.MORPH_OPEN, kernel)
+    reach = cv2.dilate(background.astype(np.uint8), np.ones((4 * feather + 1, 4 * feather + 1), dtype=np.uint8)).astype(bool)
+    _, shadow_labels = cv2.connectedComponents(shadow_like, connectivity=8)
+    touching = np.unique(shadow_labels[reach & (shadow_like > 0)])
+    shadow = np.isin(shadow_labels, touching[touching > 0])
+
+    upper = max(1, height // 2)
+    edge = np.concatenate([foreground[0], foreground[:upper, 0], foreground[:upper, -1]])
+    return mask, {
+        'foreground': float(foreground.mean()),
+        'shoulders': float(foreground[-1].mean()),
+        'edge_contact': float(edge.mean()),
+        'shadow': float(shadow.mean()),
+    }
@@ -0,0 +1,109 @@
+import threading
+import time
+from collections import deque
+
+
+class _BatchRequest:
+    def __init__(self, item):
+        self.item = item
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class MicroBatcher:
+    """Gathers concurrent requests over a short window and hands them to run_batch() together
+
+    Subclasses implement run_batch(items) -> results (same order). A dedicated dispatcher thread
+    owns the model call, so callers block only until their batch has been processed.
+    """
+
+    def __init__(self, max_batch_size=4, max_wait_ms=15, name='micro-batcher'):
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.name = name
+
+        self._pending = deque()
+        self._condition = threading.Condition()
+        self._dispatcher = None
+
+        self._metrics_lock = threading.Lock()
+        self._batch_size_counts = {}
+        self._requests = 0
+        self._wait_seconds_total = 0.0
+
+    def run_batch(self, items):
+        raise NotImplementedError
+
+    def submit(self, item):
+        """Process one item, sharing the model call with concurrent callers"""
+        if self.max_batch_size <= 1:
+            result = self.run_batch([item])[0]
+            self._record(1, 0.0)
+            return result
+
+        request = _BatchRequest(item)
+        with self._condition:
+            self._pending.append(request)
+            self._ensure_dispatcher()
+            self._condition.notify()
+
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def metrics(self):
+        with self._metrics_lock:
+            batches = sum(self._batch_size_counts.values())
+            return {
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000.0,
+                'requests': self._requests,
+                'batches': batches,
+                'avg_batch_size': (self._requests / batches) if batches else None,
+                'avg_queue_wait_ms': (self._wait_seconds_total / self._requests * 1000.0) if self._requests else None,
+                'batch_size_counts': dict(sorted(self._batch_size_counts.items())),
+            }
+
+    def _record(self, batch_size, wait_seconds):
+        with self._metrics_lock:
+            self._batch_size_counts[batch_size] = self._batch_size_counts.get(batch_size, 0) + 1
+            self._requests += batch_size
+            self._wait_seconds_total += wait_seconds
+
+    def _ensure_dispatcher(self):
+        if self._dispatcher is None:
+            self._dispatcher = threading.Thread(target=self._dispatch_loop, name=self.name)
+            self._dispatcher.daemon = True
+            self._dispatcher.start()
+
+    def _dispatch_loop(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+
+                # The first request opens the window; close it early once the batch is full
+                window_started = time.monotonic()
+                deadline = window_started + self.max_wait
+                while len(self._pending) < self.max_batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+
+                batch = [self._pending.popleft() for _ in range(min(self.max_batch_size, len(self._pending)))]
+
+            wait_seconds = time.monotonic() - window_started
+            try:
+                results = self.run_batch([request.item for request in batch])
+                for request, result in zip(batch, results):
+                    request.result = result
+            except Exception as e:
+                for request in batch:
+                    request.error = e
+            finally:
+                self._record(len(batch), wait_seconds * len(batch))
+                for request in batch:
+                    request.done.set()
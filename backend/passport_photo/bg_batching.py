@@ -0,0 +1,66 @@
+import numpy as np
+from PIL import Image
+from .batching import MicroBatcher
+
+# BiRefNet preprocessing constants, as used by rembg's BiRefNet sessions
+BIREFNET_MEAN = (0.485, 0.456, 0.406)
+BIREFNET_STD = (0.229, 0.224, 0.225)
+BIREFNET_INPUT_SIZE = (1024, 1024)
+
+
+def supports_batching(session):
+    """Only BiRefNet sessions share a preprocessing/postprocessing path we can batch"""
+    return session is not None and type(session).__name__.lower().startswith('birefnet')
+
+
+class BackgroundRemovalBatcher(MicroBatcher):
+    """Runs concurrent BiRefNet mask requests through the ONNX session as one batched tensor"""
+
+    def __init__(self, session, max_batch_size=4, max_wait_ms=15):
+        super().__init__(max_batch_size, max_wait_ms, name='bg-removal-batcher')
+        self.session = session
+
+        # Exported models with a fixed batch axis reject batches; we detect that once and stop trying
+        self._batch_supported = True
+
+    def predict_mask(self, image):
+        """Return the 'L' alpha mask for an RGB image"""
+        return self.submit(image)
+
+    def metrics(self):
+        metrics = super().metrics()
+        metrics['batching_supported'] = self._batch_supported
+        return metrics
+
+    def run_batch(self, images):
+        if len(images) > 1 and self._batch_supported:
+            try:
+                return self._run_batched(images)
+            except Exception as e:
+                print(f"⚠️ Batched background removal not supported by this model, running one by one: {e}")
+                self._batch_supported = False
+        return [mask for image in images for mask in self._run_batched([image])]
+
+    def _run_batched(self, images):
+        input_name = self.session.inner_session.get_inputs()[0].name
+        inputs = [
+            self.session.normalize(image, BIREFNET_MEAN, BIREFNET_STD, BIREFNET_INPUT_SIZE)[input_name]
+            for image in images
+        ]
+        ort_outs = self.session.inner_session.run(None, {input_name: np.concatenate(inputs, axis=0)})
+
+        masks = []
+        for index, image in enumerate(images):
+            masks.append(self._postprocess(ort_outs[0][index:index + 1], image.size))
+        return masks
+
+    def _postprocess(self, output, image_size):
+        """Same mask postprocessing as rembg's BiRefNet session, applied to one batch item"""
+        pred = 1 / (1 + np.exp(-output[:, 0, :, :]))
+        ma = np.max(pred)
+        mi = np.min(pred)
+        pred = (pred - mi) / (ma - mi)
+        pred = np.squeeze(pred)
+
+        mask = Image.fromarray((pred * 255).astype('uint8'), mode='L')
+        return mask.resize(image_size, Image.Resampling.LANCZOS)
@@ -0,0 +1,65 @@
+import hashlib
+import json
+import threading
+import time
+from django.conf import settings
+from django.db.models import Max
+from .models import Country
+
+
+class CountryListCache:
+    """Serialized country list with its ETag and Last-Modified, rebuilt only when countries change
+
+    Saving or deleting a Country invalidates the cache of the process doing it (see apps.py); other
+    processes pick the change up once their entry is older than max_age_seconds.
+    """
+
+    def __init__(self, max_age_seconds):
+        self.max_age_seconds = max_age_seconds
+        self._lock = threading.Lock()
+        self._entry = None  # (built_at, data, etag, last_modified)
+
+    def get(self):
+        """Return (data, etag, last_modified) of the country list"""
+        entry = self._entry
+        if entry is None or time.monotonic() - entry[0] > self.max_age_seconds:
+            with self._lock:
+                entry = self._entry
+                if entry is None or time.monotonic() - entry[0] > self.max_age_seconds:
+                    entry = self._build()
+                    self._entry = entry
+        return entry[1:]
+
+    def invalidate(self):
+        with self._lock:
+            self._entry = None
+
+    def _build(self):
+        from .serializers import CountrySerializer
+
+        countries = Country.objects.all().order_by('name')
+        data = CountrySerializer(countries, many=True).data
+        # Hash of the payload rather than a timestamp, so deletions change the ETag too
+        etag = '"{}"'.format(hashlib.blake2b(json.dumps(data).encode(), digest_size=16).hexdigest())
+        last_modified = Country.objects.aggregate(last_modified=Max('updated_at'))['last_modified']
+        return time.monotonic(), data, etag, last_modified
+
+
+_country_cache = None
+_country_cache_lock = threading.Lock()
+
+
+def get_country_cache():
+    """Return the process-wide country list cache"""
+    global _country_cache
+    if _country_cache is None:
+        with _country_cache_lock:
+            if _country_cache is None:
+                list_settings = settings.PASSPORT_PHOTO_SETTINGS.get('COUNTRY_LIST', {})
+                _country_cache = CountryListCache(list_settings.get('CACHE_SECONDS', 60))
+    return _country_cache
+
+
+def invalidate_country_cache(**kwargs):
+    """Signal receiver for Country saves and deletes"""
+    get_country_cache().invalidate()
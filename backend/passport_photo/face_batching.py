@@ -0,0 +1,54 @@
+import numpy as np
+from .batching import MicroBatcher
+
+
+def boxes_to_arrays(result):
+    """Pull all boxes of one ultralytics result to host memory in a single transfer per tensor"""
+    boxes = result.boxes
+    if boxes is None or len(boxes) == 0:
+        return np.empty((0, 4), dtype=np.float32), np.empty((0,), dtype=np.float32)
+    return boxes.xyxy.cpu().numpy(), boxes.conf.cpu().numpy()
+
+
+def filter_face_boxes(xyxy, conf, image_size, min_confidence, aspect_range, area_range):
+    """Vectorized confidence / aspect-ratio / relative-area filter over all boxes of one image"""
+    img_width, img_height = image_size
+    widths = xyxy[:, 2] - xyxy[:, 0]
+    heights = xyxy[:, 3] - xyxy[:, 1]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        aspect_ratios = widths / heights
+    area_ratios = (widths * heights) / float(img_width * img_height)
+
+    keep = (
+        (conf > min_confidence)
+        & (aspect_ratios >= aspect_range[0]) & (aspect_ratios <= aspect_range[1])
+        & (area_ratios >= area_range[0]) & (area_ratios <= area_range[1])
+    )
+    return xyxy[keep], conf[keep]
+
+
+class FaceDetectionBatcher(MicroBatcher):
+    """Runs concurrent face detection requests through one ultralytics predict call"""
+
+    def __init__(self, model, model_lock, max_batch_size=8, max_wait_ms=5):
+        super().__init__(max_batch_size, max_wait_ms, name='face-detection-batcher')
+        self.model = model
+        self.model_lock = model_lock
+
+    def predict(self, img_array, imgsz=None):
+        """Return (xyxy, conf) arrays of raw detections for one RGB image array"""
+        return self.submit((img_array, imgsz))
+
+    def run_batch(self, items):
+        # One predict call per inference size present in the batch
+        outputs = [None] * len(items)
+        sizes = {imgsz for _, imgsz in items}
+        for imgsz in sizes:
+            indexes = [index for index, item in enumerate(items) if item[1] == imgsz]
+            kwargs = {'imgsz': imgsz} if imgsz else {}
+            with self.model_lock:
+                results = self.model([items[index][0] for index in indexes], verbose=False, **kwargs)
+            for index, result in zip(indexes, results):
+                outputs[index] = boxes_to_arrays(result)
+        return outputs
@@ -0,0 +1,76 @@
+import threading
+from collections import deque
+from django.conf import settings
+from django.db import close_old_connections
+
+
+class JobExecutor:
+    """Bounded pool of worker threads that runs background jobs from a FIFO queue"""
+
+    def __init__(self, max_workers):
+        self.max_workers = max(1, int(max_workers))
+        self._queue = deque()
+        self._running = set()
+        self._workers = []
+        self._condition = threading.Condition()
+
+    def submit(self, job_id, func, *args):
+        """Queue a job and return its 1-based position in this process's queue"""
+        with self._condition:
+            self._queue.append((job_id, func, args))
+            position = len(self._queue)
+            self._ensure_workers()
+            self._condition.notify()
+        return position
+
+    def stats(self):
+        with self._condition:
+            return {
+                'max_workers': self.max_workers,
+                'running': len(self._running),
+                'queued': len(self._queue),
+            }
+
+    def _ensure_workers(self):
+        # Workers are started lazily so importing the module never spawns threads
+        while len(self._workers) < self.max_workers:
+            worker = threading.Thread(
+                target=self._work,
+                name=f'photo-job-worker-{len(self._workers) + 1}'
+            )
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+                job_id, func, args = self._queue.popleft()
+                self._running.add(job_id)
+
+            close_old_connections()
+            try:
+                func(*args)
+            except Exception as e:
+                print(f"⚠️ Background job {job_id} crashed: {e}")
+            finally:
+                close_old_connections()
+                with self._condition:
+                    self._running.discard(job_id)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_job_executor():
+    """Return the process-wide background job executor"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                max_workers = settings.PASSPORT_PHOTO_SETTINGS.get('MAX_CONCURRENT_JOBS', 2)
+                _executor = JobExecutor(max_workers)
+    return _executor
@@ -0,0 +1,310 @@
+import os
+import socket
+import threading
+import time
+import uuid
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction, close_old_connections
+from django.db.models import F
+from django.utils import timezone
+from .models import PhotoProcessingJob, PhotoOutput
+from .services import PassportPhotoProcessor
+from .job_executor import get_job_executor
+from .progress import get_progress_broadcaster, record_stage
+from .prepared_sessions import get_prepared_store, analyze_job_session, render_session
+
+
+def _queue_settings():
+    return settings.PASSPORT_PHOTO_SETTINGS.get('JOB_QUEUE', {})
+
+
+def uses_database_queue():
+    """True when jobs are picked up by run_photo_workers instead of in-process threads"""
+    return _queue_settings().get('BACKEND', 'thread') == 'database'
+
+
+def enqueue_job(job):
+    """Hand a pending job to the configured backend and return its 1-based queue position"""
+    if not uses_database_queue():
+        get_job_executor().submit(job.id, process_photo_background, job.id)
+    # With the database backend the row itself is the queue entry; a worker will claim it
+    return queue_position(job)
+
+
+def queue_position(job):
+    """1-based position of a pending job among all pending jobs, or None if it is not waiting
+
+    Exact for the database queue, which every worker takes jobs from in this order. The in-process
+    executor keeps a separate queue per web process, so with several gunicorn workers the count of
+    older pending jobs is only an approximation of when this one will start.
+    """
+    if job.status != 'pending':
+        return None
+    return PhotoProcessingJob.objects.filter(
+        status='pending',
+        created_at__lte=job.created_at,
+    ).count()
+
+
+def claim_next_job(worker_id, lease_seconds=None):
+    """Claim the oldest pending job for this worker, or return None if the queue is empty"""
+    lease_seconds = lease_seconds or _queue_settings().get('LEASE_SECONDS', 300)
+
+    while True:
+        with transaction.atomic():
+            # skip_locked lets concurrent workers pass over rows another worker is claiming;
+            # backends without row locks (SQLite) rely on the conditional update below instead
+            candidate = (
+                PhotoProcessingJob.objects
+                .select_for_update(skip_locked=True, of=('self',))
+                .filter(status='pending')
+                # A render reusing an analysis waits for it in the queue, not in a worker
+                .exclude(analysis__status__in=['pending', 'processing'])
+                .order_by('created_at')
+                .values_list('id', flat=True)
+                .first()
+            )
+            if candidate is None:
+                return None
+
+            now = timezone.now()
+            claimed = PhotoProcessingJob.objects.filter(id=candidate, status='pending').update(
+                status='processing',
+                worker_id=worker_id,
+                lease_expires_at=now + timezone.timedelta(seconds=lease_seconds),
+                attempts=F('attempts') + 1,
+                updated_at=now,
+            )
+            if claimed:
+                return PhotoProcessingJob.objects.select_related('country').get(id=candidate)
+        # Another worker won the race for this row; try the next one
+
+
+def renew_lease(job_id, worker_id, lease_seconds=None):
+    """Extend the lease on a job this worker still owns; returns False if ownership was lost"""
+    lease_seconds = lease_seconds or _queue_settings().get('LEASE_SECONDS', 300)
+    return PhotoProcessingJob.objects.filter(
+        id=job_id, status='processing', worker_id=worker_id
+    ).update(lease_expires_at=timezone.now() + timezone.timedelta(seconds=lease_seconds)) > 0
+
+
+def requeue_expired_leases():
+    """Put jobs whose worker died back in the queue, failing them after too many attempts"""
+    now = timezone.now()
+    max_attempts = _queue_settings().get('MAX_ATTEMPTS', 3)
+    expired = PhotoProcessingJob.objects.filter(status='processing', lease_expires_at__lt=now)
+
+    failed = expired.filter(attempts__gte=max_attempts).update(
+        status='failed',
+        error_message='Processing was interrupted too many times',
+        worker_id=None,
+        lease_expires_at=None,
+        updated_at=now,
+    )
+    requeued = expired.filter(attempts__lt=max_attempts).update(
+        status='pending',
+        worker_id=None,
+        lease_expires_at=None,
+        updated_at=now,
+    )
+    if failed or requeued:
+        print(f"♻️ Re-queued {requeued} job(s) with expired leases, failed {failed}")
+    return requeued
+
+
+def country_specs(country):
+    """Rendering specifications the processor needs for one country"""
+    return {
+        'photo_width': country.photo_width,
+        'photo_height': country.photo_height,
+        'face_height_ratio': country.face_height_ratio,
+        'country_code': country.code,
+    }
+
+
+def _render_from_analysis(analysis_id, countries, processor):
+    """Outputs rendered from a speculative analysis session, or None if there is no usable one
+
+    Render jobs only start once their analysis has finished (see claim_next_job and
+    release_renders), so this never waits; an analysis that gave up without recording a result
+    falls back to the full pipeline. A failed analysis fails the render with its error.
+    """
+    token = str(analysis_id)
+    metadata = get_prepared_store().metadata(token)
+    if metadata is None or metadata['state'] == 'analyzing':
+        return None
+    if metadata['state'] == 'failed':
+        raise ValueError(metadata['error'])
+
+    rendered = [render_session(token, country_specs(country), processor) for country in countries]
+    # The session can expire between the check and the render; the full pipeline covers that too
+    return None if None in rendered else rendered
+
+
+def release_renders(analysis_id):
+    """Hand the render jobs that were waiting for a finished analysis to the in-process executor
+
+    The database queue needs no hand-off: claim_next_job skips renders until their analysis is done.
+    """
+    if uses_database_queue():
+        return
+    for job in PhotoProcessingJob.objects.filter(analysis_id=analysis_id, status='pending'):
+        enqueue_job(job)
+
+
+def process_photo_background(job_id, worker_id=None):
+    """Background task to process photo, or to analyse one for a later render (kind 'analysis')
+
+    worker_id is the database-queue worker holding the job's lease (None for in-process jobs). The
+    result is only recorded while the job still belongs to it: a worker whose lease expired and whose
+    job was handed to another worker drops its result instead of overwriting the new owner's.
+    """
+    owned = PhotoProcessingJob.objects.filter(id=job_id, worker_id=worker_id, status='processing')
+    try:
+        job = PhotoProcessingJob.objects.select_related('country').get(id=job_id)
+        # Queue workers claimed the job already; in-process jobs claim it here, so a job handed to
+        # the executor twice (see release_renders) still runs once
+        started = PhotoProcessingJob.objects.filter(
+            id=job_id, worker_id=worker_id, status='processing' if worker_id else 'pending'
+        ).update(status='processing', stage='', updated_at=timezone.now())
+        if not started:
+            print(f"⚠️ Job {job_id} is no longer waiting for this worker; skipping it")
+            return
+        job.stage = ''
+        get_progress_broadcaster().publish(job.id)
+
+        # Multi-country jobs have one output row per requested country; single-country jobs have none
+        outputs = list(job.outputs.select_related('country').order_by('id'))
+        countries = [output.country for output in outputs] or [job.country]
+
+        # Process the photo, reporting each stage to job status requests
+        processor = PassportPhotoProcessor()
+        def report_stage(stage):
+            job.stage = stage
+            record_stage(job.id, stage)
+        processor.progress = report_stage
+
+        # Read original photo
+        with job.original_photo.open('rb') as f:
+            image_bytes = f.read()
+
+        if job.kind == 'analysis':
+            # Country-independent stages only; prepare and analysed uploads pick the result up from the session
+            analyze_job_session(str(job.id), image_bytes, processor)
+            finished = owned.update(status='completed', lease_expires_at=None, updated_at=timezone.now())
+            if not finished:
+                print(f"⚠️ Analysis {job_id} was re-queued while processing; leaving it to its new owner")
+                return
+            get_progress_broadcaster().publish(job.id)
+            release_renders(job.id)
+            return
+
+        processed = None
+        if job.analysis_id:
+            processed = _render_from_analysis(job.analysis_id, countries, processor)
+            if processed is not None:
+                report_stage('rendered')
+        if processed is None:
+            # Create passport photos; the analysis is shared by every country
+            processed = processor.create_passport_photos(image_bytes, [country_specs(country) for country in countries])
+
+        # Files are written first; the rows only point at them if the job is still ours
+        for output, processed_bytes in zip(outputs, processed):
+            output.processed_photo.save(
+                f"passport_{job.id}_{output.country.code.lower()}.jpg",
+                ContentFile(processed_bytes),
+                save=False,
+            )
+
+        # Save processed photo (the job's primary country)
+        filename = f"passport_{job.id}.jpg"
+        job.processed_photo.save(
+            filename,
+            ContentFile(processed[0]),
+            save=False
+        )
+
+        with transaction.atomic():
+            finished = owned.update(
+                status='completed',
+                processed_photo=job.processed_photo.name,
+                lease_expires_at=None,
+                updated_at=timezone.now(),
+            )
+            if finished and outputs:
+                PhotoOutput.objects.bulk_update(outputs, ['processed_photo'])
+
+        if not finished:
+            print(f"⚠️ Job {job_id} was re-queued while processing; dropping this worker's result")
+            for photo in [job.processed_photo] + [output.processed_photo for output in outputs]:
+                photo.delete(save=False)
+            return
+        get_progress_broadcaster().publish(job.id)
+
+    except Exception as e:
+        try:
+            if owned.update(status='failed', error_message=str(e), lease_expires_at=None, updated_at=timezone.now()):
+                get_progress_broadcaster().publish(job_id)
+                # Renders waiting for a failed analysis fail with its error
+                release_renders(job_id)
+            else:
+                print(f"⚠️ Job {job_id} failed after it was re-queued; leaving it to its new owner: {e}")
+        except Exception as save_error:
+            print(f"⚠️ Could not record the failure of job {job_id} ({e}): {save_error}")
+
+
+class PhotoWorker:
+    """Long-running worker that claims jobs from the database queue and processes them"""
+
+    def __init__(self, worker_id=None, poll_interval=None, lease_seconds=None):
+        queue_settings = _queue_settings()
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.poll_interval = poll_interval or queue_settings.get('POLL_INTERVAL_SECONDS', 1.0)
+        self.lease_seconds = lease_seconds or queue_settings.get('LEASE_SECONDS', 300)
+        self.stop_event = threading.Event()
+
+    def run_forever(self):
+        print(f"👷 Photo worker {self.worker_id} started")
+        while not self.stop_event.is_set():
+            close_old_connections()
+            try:
+                requeue_expired_leases()
+                job = claim_next_job(self.worker_id, self.lease_seconds)
+            except Exception as e:
+                print(f"⚠️ Worker {self.worker_id} could not poll the queue: {e}")
+                job = None
+
+            if job is None:
+                self.stop_event.wait(self.poll_interval)
+                continue
+
+            self.run_job(job)
+        print(f"👷 Photo worker {self.worker_id} stopped")
+
+    def run_job(self, job):
+        started = time.monotonic()
+        done = threading.Event()
+
+        def heartbeat():
+            # Renew well before expiry so a slow photo is not handed to another worker
+            while not done.wait(self.lease_seconds / 3):
+                try:
+                    if not renew_lease(job.id, self.worker_id, self.lease_seconds):
+                        return
+                except Exception as e:
+                    print(f"⚠️ Lease renewal failed for job {job.id}: {e}")
+                finally:
+                    close_old_connections()
+
+        heartbeat_thread = threading.Thread(target=heartbeat, daemon=True)
+        heartbeat_thread.start()
+        try:
+            process_photo_background(job.id, self.worker_id)
+        finally:
+            done.set()
+            heartbeat_thread.join()
+        print(f"✓ Worker {self.worker_id} finished job {job.id} in {time.monotonic() - started:.1f}s")
+
+    def stop(self):
+        self.stop_event.set()
@@ -0,0 +1,74 @@
+import multiprocessing
+import signal
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+def _run_worker(poll_interval, lease_seconds, warm_up):
+    """Entry point for a spawned worker process"""
+    import django
+    django.setup()
+    
+    from passport_photo.job_queue import PhotoWorker
+    from passport_photo.model_registry import get_model_registry
+    
+    worker = PhotoWorker(poll_interval=poll_interval, lease_seconds=lease_seconds)
+    signal.signal(signal.SIGTERM, lambda *args: worker.stop())
+    signal.signal(signal.SIGINT, lambda *args: worker.stop())
+    
+    if warm_up:
+        get_model_registry().warm_up()
+    worker.run_forever()
+
+class Command(BaseCommand):
+    help = 'Run photo processing workers that consume the database-backed job queue'
+    
+    def add_arguments(self, parser):
+        queue_settings = settings.PASSPORT_PHOTO_SETTINGS.get('JOB_QUEUE', {})
+        parser.add_argument(
+            '--processes', type=int, default=queue_settings.get('WORKER_PROCESSES', 1),
+            help='Number of worker processes, each with its own copy of the models'
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=queue_settings.get('POLL_INTERVAL_SECONDS', 1.0),
+            help='Seconds an idle worker waits between queue polls'
+        )
+        parser.add_argument(
+            '--lease-seconds', type=int, default=queue_settings.get('LEASE_SECONDS', 300),
+            help='How long a claimed job stays owned without a heartbeat before it is re-queued'
+        )
+        parser.add_argument(
+            '--no-warm-up', action='store_true',
+            help='Skip loading the models before claiming the first job'
+        )
+    
+    def handle(self, *args, **options):
+        worker_args = (options['poll_interval'], options['lease_seconds'], not options['no_warm_up'])
+        processes = max(1, options['processes'])
+        
+        if processes == 1:
+            self.stdout.write('Starting 1 photo worker')
+            _run_worker(*worker_args)
+            return
+        
+        # Spawn (not fork) so each child initialises CUDA and its DB connection from scratch
+        connections.close_all()
+        context = multiprocessing.get_context('spawn')
+        children = [
+            context.Process(target=_run_worker, args=worker_args, name=f'photo-worker-{i + 1}')
+            for i in range(processes)
+        ]
+        
+        def shutdown(*args):
+            for child in children:
+                if child.is_alive():
+                    child.terminate()
+        
+        signal.signal(signal.SIGTERM, shutdown)
+        signal.signal(signal.SIGINT, shutdown)
+        
+        self.stdout.write(f'Starting {processes} photo workers')
+        for child in children:
+            child.start()
+        for child in children:
+            child.join()
@@ -0,0 +1,16 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from passport_photo.model_registry import get_model_registry
+
+class Command(BaseCommand):
+    help = 'Load the face detection and background removal models and run one dummy inference through each'
+    
+    def handle(self, *args, **options):
+        registry = get_model_registry()
+        ready = registry.warm_up()
+        
+        self.stdout.write(json.dumps(registry.status(), indent=2))
+        
+        if not ready:
+            raise CommandError('Model warm-up failed')
+        self.stdout.write(self.style.SUCCESS('Models are warm'))
@@ -0,0 +1,152 @@
+import hashlib
+import io
+import os
+import threading
+import numpy as np
+from PIL import Image
+from django.conf import settings
+
+# Bump whenever mask prediction or postprocessing changes so stale masks are never served
+MASK_PIPELINE_VERSION = 3
+
+
+def source_digest(image_bytes):
+    """Content address of an upload's encoded bytes; decoding, EXIF orientation and resizing all follow from them"""
+    return hashlib.blake2b(image_bytes, digest_size=20).hexdigest()
+
+
+def mask_cache_key(source, model_name):
+    """Cache address of the mask of an upload (its source_digest) under the current model and pipeline
+
+    Keyed on the upload rather than on decoded pixels, so the automatic pipeline (which caps the
+    working resolution) and prepared sessions (which decode at full size) find the same entry.
+    """
+    photo_settings = settings.PASSPORT_PHOTO_SETTINGS
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(f'{MASK_PIPELINE_VERSION}|{model_name}|{source}|'.encode())
+    # Proxy and backdrop-shortcut settings change the mask, so they are part of the address too
+    digest.update(repr(sorted(photo_settings.get('BACKGROUND_REMOVAL_PROXY', {}).items())).encode())
+    digest.update(repr(sorted(photo_settings.get('UNIFORM_BACKDROP', {}).items())).encode())
+    return digest.hexdigest()
+
+
+class MaskCache:
+    """Disk cache of single-channel alpha masks with a size cap and least-recently-used eviction
+
+    Masks are stored as grayscale PNGs at model (proxy) resolution, one file per key. Reads bump
+    the file's mtime, so the oldest mtimes are the least recently used entries; several processes
+    can share the directory.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = str(directory)
+        self.max_bytes = int(max_bytes)
+        self._lock = threading.Lock()
+        self._size = None  # Bytes on disk, counted on first write
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, key):
+        """Return the cached uint8 mask for key, or None"""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                mask = np.asarray(Image.open(io.BytesIO(f.read())).convert('L'))
+            os.utime(path)
+        except (OSError, ValueError):
+            with self._lock:
+                self._misses += 1
+            return None
+
+        with self._lock:
+            self._hits += 1
+        return mask
+
+    def put(self, key, mask):
+        """Store a uint8 mask, evicting the least recently used masks if over the size cap"""
+        buffer = io.BytesIO()
+        Image.fromarray(mask).save(buffer, format='PNG')
+        data = buffer.getvalue()
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary name and rename so readers never see a partial file
+        temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+        with self._lock:
+            if self._size is None:
+                self._size = self._disk_usage()
+            else:
+                self._size += len(data)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'directory': self.directory,
+                'max_bytes': self.max_bytes,
+                'bytes': self._size,
+                'hits': self._hits,
+                'misses': self._misses,
+            }
+
+    def _path(self, key):
+        # Two-level fan-out keeps directories small
+        return os.path.join(self.directory, key[:2], f'{key}.png')
+
+    def _entries(self):
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+        for bucket in os.scandir(self.directory):
+            if not bucket.is_dir():
+                continue
+            for entry in os.scandir(bucket.path):
+                if entry.name.endswith('.png'):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def _disk_usage(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def _evict(self):
+        # Rescan so masks written by other processes are accounted for, then trim to 90% of the cap
+        entries = sorted(self._entries())
+        self._size = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9
+        for _, size, path in entries:
+            if self._size <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._size -= size
+
+
+_mask_cache = None
+_mask_cache_lock = threading.Lock()
+
+
+def get_mask_cache():
+    """Return the process-wide mask cache, or None when disabled"""
+    global _mask_cache
+    cache_settings = settings.PASSPORT_PHOTO_SETTINGS.get('MASK_CACHE', {})
+    if not cache_settings.get('ENABLED', False):
+        return None
+    if _mask_cache is None:
+        with _mask_cache_lock:
+            if _mask_cache is None:
+                _mask_cache = MaskCache(
+                    cache_settings.get('DIRECTORY'),
+                    cache_settings.get('MAX_SIZE_MB', 512) * 1024 * 1024,
+                )
+    return _mask_cache
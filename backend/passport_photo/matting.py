@@ -0,0 +1,62 @@
+import cv2
+import numpy as np
+from PIL import Image
+
+
+def proxy_size(size, max_dimension):
+    """Size an image of the given size is downscaled to by make_proxy; returns (size, scale)"""
+    width, height = size
+    long_edge = max(width, height)
+    if not max_dimension or long_edge <= max_dimension:
+        return (width, height), 1.0
+
+    scale = max_dimension / long_edge
+    return (max(1, round(width * scale)), max(1, round(height * scale))), scale
+
+
+def make_proxy(image, max_dimension):
+    """Downscale an image so its long edge is at most max_dimension; returns (proxy, scale)"""
+    size, scale = proxy_size(image.size, max_dimension)
+    if scale == 1.0:
+        return image, 1.0
+
+    # reducing_gap lets Pillow box-reduce by an integer factor before resampling, far cheaper on camera-size input
+    return image.resize(size, Image.Resampling.BILINEAR, reducing_gap=2.0), scale
+
+
+def _gray(image):
+    return cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2GRAY).astype(np.float32) / 255.0
+
+
+def _box(array, radius):
+    return cv2.boxFilter(array, -1, (2 * radius + 1, 2 * radius + 1))
+
+
+def upsample_mask(mask, image, proxy=None, radius=8, eps=1e-3):
+    """Upsample a proxy-resolution uint8 alpha mask to image's size
+
+    With proxy given, edges are refined with a fast guided filter (He & Sun, 2015): the linear
+    coefficients are solved at proxy resolution against the proxy's luminance and only they are
+    upsampled, so the full-resolution cost is one multiply-add per pixel.
+    """
+    width, height = image.size
+    if proxy is None:
+        return cv2.resize(mask, (width, height), interpolation=cv2.INTER_LINEAR)
+
+    # Radius is given in working-resolution pixels; scale it down to the proxy
+    low_radius = max(1, round(radius * proxy.width / width))
+    guide_low = _gray(proxy)
+    alpha_low = mask.astype(np.float32) / 255.0
+
+    mean_i = _box(guide_low, low_radius)
+    mean_p = _box(alpha_low, low_radius)
+    cov_ip = _box(guide_low * alpha_low, low_radius) - mean_i * mean_p
+    var_i = _box(guide_low * guide_low, low_radius) - mean_i * mean_i
+
+    a = cov_ip / (var_i + eps)
+    b = mean_p - a * mean_i
+    a = cv2.resize(_box(a, low_radius), (width, height), interpolation=cv2.INTER_LINEAR)
+    b = cv2.resize(_box(b, low_radius), (width, height), interpolation=cv2.INTER_LINEAR)
+
+    refined = a * _gray(image) + b
+    return np.clip(refined * 255.0 + 0.5, 0, 255).astype(np.uint8)
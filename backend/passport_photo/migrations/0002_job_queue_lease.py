@@ -0,0 +1,32 @@
+# Generated by Django 5.2.5 on 2026-10-16 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('passport_photo', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photoprocessingjob',
+            name='attempts',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='photoprocessingjob',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='photoprocessingjob',
+            name='worker_id',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='photoprocessingjob',
+            index=models.Index(fields=['status', 'created_at'], name='job_status_created_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.5 on 2026-10-16 14:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('passport_photo', '0002_job_queue_lease'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PhotoOutput',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('processed_photo', models.ImageField(blank=True, null=True, upload_to='uploads/processed/')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('country', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='passport_photo.country')),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='outputs', to='passport_photo.photoprocessingjob')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('job', 'country'), name='unique_output_per_country')],
+            },
+        ),
+    ]
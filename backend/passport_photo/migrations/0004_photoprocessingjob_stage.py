@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-16 16:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('passport_photo', '0003_photooutput'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photoprocessingjob',
+            name='stage',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.5 on 2026-10-16 17:20
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('passport_photo', '0004_photoprocessingjob_stage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='country',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
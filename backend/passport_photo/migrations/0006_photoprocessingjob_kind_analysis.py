@@ -0,0 +1,29 @@
+# Generated by Django 5.2.5 on 2026-10-16 20:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('passport_photo', '0005_country_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photoprocessingjob',
+            name='analysis',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='renders', to='passport_photo.photoprocessingjob'),
+        ),
+        migrations.AddField(
+            model_name='photoprocessingjob',
+            name='kind',
+            field=models.CharField(choices=[('render', 'Render'), ('analysis', 'Analysis')], default='render', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='photoprocessingjob',
+            name='country',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='passport_photo.country'),
+        ),
+    ]
@@ -0,0 +1,404 @@
+import threading
+import time
+import cv2
+import numpy as np
+from PIL import Image
+from rembg import remove, new_session
+from ultralytics import YOLO
+from django.conf import settings
+from .bg_batching import BackgroundRemovalBatcher, supports_batching
+from .face_batching import FaceDetectionBatcher
+
+# A model that failed to load (weights missing mid-deploy, out of memory) is tried again after this long
+MODEL_LOAD_RETRY_SECONDS = 60
+
+
+class ModelRegistry:
+    """Process-wide registry that loads each inference model once and shares it across requests and threads"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+
+        # Ultralytics predictors keep per-call state, so inference on the shared model is serialized
+        self.yolo_lock = threading.Lock()
+
+        self._gpu_selected = False
+        self._selected_gpu = None
+
+        self._yolo_loaded = False
+        self._yolo_face_model = None
+        self._yolo_model_path = None
+        self._yolo_retry_at = 0.0
+
+        self._bg_model = settings.PASSPORT_PHOTO_SETTINGS.get('BACKGROUND_REMOVAL_MODEL', 'u2net')
+        self._bg_loaded = False
+        self._bg_session = None
+        self._bg_retry_at = 0.0
+        self._fallback_bg_loaded = False
+        self._fallback_bg_session = None
+        self._bg_batcher_loaded = False
+        self._bg_batcher = None
+        self._face_batcher_loaded = False
+        self._face_batcher = None
+
+        self._load_seconds = {}
+
+        # OpenCV cascades are not safe to share across threads, so each thread parses the XML once
+        self._thread_local = threading.local()
+
+        # How often each detection fallback tier produced the answer, and what it cost
+        self._detection_tiers = {}
+        self._matting_paths = {}
+        self._inference_sizes = {}
+
+        self._warm_up_state = 'not_started'
+        self._warm_up_error = None
+        self._warm_up_seconds = None
+        self._warm_up_failed_at = None
+
+    @property
+    def bg_model_name(self):
+        return self._bg_model
+
+    @property
+    def selected_gpu(self):
+        """GPU index chosen for inference, selected once per process (None means CPU)"""
+        if not self._gpu_selected:
+            with self._lock:
+                if not self._gpu_selected:
+                    self._selected_gpu = self._auto_select_gpu()
+                    self._gpu_selected = True
+        return self._selected_gpu
+
+    def _auto_select_gpu(self):
+        """Auto select best GPU: prefer GPU 1 if available with >2GB free, fallback to GPU 0"""
+        import torch
+        if not torch.cuda.is_available():
+            print("🚫 No CUDA GPUs available, using CPU")
+            return None
+
+        try:
+            gpu_info = []
+            for i in range(torch.cuda.device_count()):
+                gpu_name = torch.cuda.get_device_name(i)
+                torch.cuda.set_device(i)
+                total_mem = torch.cuda.get_device_properties(i).total_memory / (1024**3)
+                free_mem, _ = torch.cuda.mem_get_info()
+                free_mem_gb = free_mem / (1024**3)
+                gpu_info.append({
+                    'id': i,
+                    'name': gpu_name,
+                    'free_mem_gb': free_mem_gb,
+                    'total_mem_gb': total_mem
+                })
+
+            # Select GPU 1 if available and has >2GB free memory, otherwise use GPU 0
+            if len(gpu_info) > 1 and gpu_info[1]['free_mem_gb'] > 2.0:
+                selected_gpu = 1
+                print(f"🎮 Auto-selected GPU 1: {gpu_info[1]['name']} ({gpu_info[1]['free_mem_gb']:.1f}GB free)")
+            else:
+                selected_gpu = 0
+                if len(gpu_info) > 0:
+                    print(f"🎮 Using GPU 0: {gpu_info[0]['name']} ({gpu_info[0]['free_mem_gb']:.1f}GB free)")
+
+            return selected_gpu
+
+        except Exception as e:
+            print(f"⚠️ GPU selection error, using GPU 0: {e}")
+            return 0
+
+    def get_yolo_face_model(self):
+        """Return the shared YOLO face model, loading it on first use
+
+        Returns None while the model is unavailable; a failed load is retried once
+        MODEL_LOAD_RETRY_SECONDS have passed rather than disabling YOLO for the life of the process.
+        """
+        if self._yolo_face_model is None and time.monotonic() >= self._yolo_retry_at:
+            with self._lock:
+                if self._yolo_face_model is None and time.monotonic() >= self._yolo_retry_at:
+                    started = time.monotonic()
+                    self._yolo_face_model = self._load_yolo_face_model()
+                    self._load_seconds['yolo_face'] = time.monotonic() - started
+                    self._yolo_loaded = True
+                    if self._yolo_face_model is None:
+                        self._yolo_retry_at = time.monotonic() + MODEL_LOAD_RETRY_SECONDS
+        return self._yolo_face_model
+
+    def _load_yolo_face_model(self):
+        selected_gpu = self.selected_gpu
+
+        # Load YapaLab YOLOv8n-face model for accurate face detection
+        model_path = settings.PASSPORT_PHOTO_SETTINGS.get('YOLO_FACE_MODEL_PATH', '/tmp/yolov8n-face.pt')
+
+        try:
+            # Try YapaLab face model first (most accurate)
+            model = YOLO(model_path)
+            if selected_gpu is not None:
+                model.to(f'cuda:{selected_gpu}')
+            self._yolo_model_path = model_path
+            print(f"✓ Loaded YapaLab YOLOv8n-face model from {model_path} on GPU {selected_gpu}")
+            return model
+        except Exception as e:
+            print(f"Failed to load YapaLab face model from {model_path}: {e}")
+            try:
+                # Fallback to standard YOLO
+                model = YOLO('yolov8n.pt')
+                if selected_gpu is not None:
+                    model.to(f'cuda:{selected_gpu}')
+                self._yolo_model_path = 'yolov8n.pt'
+                print(f"✓ Loaded standard YOLOv8n model as fallback on GPU {selected_gpu}")
+                return model
+            except Exception as e2:
+                print(f"Failed to load any YOLO model: {e2}")
+                return None
+
+    def get_face_batcher(self):
+        """Return the shared batching scheduler for YOLO face detection, or None if disabled"""
+        if not self._face_batcher_loaded:
+            with self._lock:
+                if not self._face_batcher_loaded:
+                    batching = settings.PASSPORT_PHOTO_SETTINGS.get('FACE_DETECTION_BATCHING', {})
+                    model = self.get_yolo_face_model()
+                    if not batching.get('ENABLED', False):
+                        self._face_batcher_loaded = True
+                    elif model is not None:
+                        self._face_batcher = FaceDetectionBatcher(
+                            model,
+                            self.yolo_lock,
+                            max_batch_size=batching.get('MAX_BATCH_SIZE', 8),
+                            max_wait_ms=batching.get('MAX_WAIT_MS', 5),
+                        )
+                        self._face_batcher_loaded = True
+                    # Without a model the batcher is built on a later call, once the load retry succeeds
+        return self._face_batcher
+
+    def get_face_cascade(self):
+        """Return this thread's Haar cascade face detector, loading it on first use in the thread"""
+        face_cascade = getattr(self._thread_local, 'face_cascade', None)
+        if face_cascade is None:
+            face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+            if face_cascade.empty():
+                raise Exception("Failed to load Haar cascade")
+            self._thread_local.face_cascade = face_cascade
+        return face_cascade
+
+    def get_bg_session(self):
+        """Return the shared background removal session, creating it on first use
+
+        Returns None while the configured model is unavailable (callers fall back to u2net); like
+        YOLO, a failed load is retried once MODEL_LOAD_RETRY_SECONDS have passed.
+        """
+        if self._bg_session is None and time.monotonic() >= self._bg_retry_at:
+            with self._lock:
+                if self._bg_session is None and time.monotonic() >= self._bg_retry_at:
+                    started = time.monotonic()
+                    self._bg_session = self._create_bg_session()
+                    self._load_seconds['background_removal'] = time.monotonic() - started
+                    self._bg_loaded = True
+                    if self._bg_session is None:
+                        self._bg_retry_at = time.monotonic() + MODEL_LOAD_RETRY_SECONDS
+        return self._bg_session
+
+    def _create_bg_session(self):
+        """Create background removal session with GPU acceleration"""
+        selected_gpu = self.selected_gpu
+
+        # Setup GPU providers for acceleration using pre-selected GPU
+        import torch
+        providers = ['CPUExecutionProvider']
+        if torch.cuda.is_available() and selected_gpu is not None:
+            # Use the GPU selected for this process
+            provider_options = {
+                'device_id': selected_gpu,
+                'arena_extend_strategy': 'kSameAsRequested',
+                'gpu_mem_limit': 20 * 1024 * 1024 * 1024,  # 20GB limit
+                'cudnn_conv_algo_search': 'EXHAUSTIVE'
+            }
+            providers = [('CUDAExecutionProvider', provider_options), 'CPUExecutionProvider']
+            print(f"🔄 Using GPU {selected_gpu} for BiRefNet background removal")
+
+        try:
+            print(f"🔄 Initializing {self._bg_model} background removal model with providers: {providers}")
+            session = new_session(self._bg_model, providers=providers)
+            print(f"✓ Loaded {self._bg_model} background removal model with GPU acceleration")
+            return session
+        except Exception as e:
+            print(f"⚠️ Failed to load {self._bg_model} model with GPU, falling back to CPU: {e}")
+            try:
+                session = new_session(self._bg_model, providers=['CPUExecutionProvider'])
+                print(f"✓ Loaded {self._bg_model} background removal model (CPU fallback)")
+                return session
+            except Exception as e2:
+                print(f"⚠️ Failed to load {self._bg_model} model, using default u2net: {e2}")
+                return None
+
+    def get_bg_batcher(self):
+        """Return the shared micro-batching scheduler for the background session, or None if disabled"""
+        if not self._bg_batcher_loaded:
+            with self._lock:
+                if not self._bg_batcher_loaded:
+                    batching = settings.PASSPORT_PHOTO_SETTINGS.get('BACKGROUND_REMOVAL_BATCHING', {})
+                    session = self.get_bg_session()
+                    if not batching.get('ENABLED', False):
+                        self._bg_batcher_loaded = True
+                    elif session is not None:
+                        if supports_batching(session):
+                            self._bg_batcher = BackgroundRemovalBatcher(
+                                session,
+                                max_batch_size=batching.get('MAX_BATCH_SIZE', 4),
+                                max_wait_ms=batching.get('MAX_WAIT_MS', 15),
+                            )
+                        self._bg_batcher_loaded = True
+                    # Without a session the batcher is built on a later call, once the load retry succeeds
+        return self._bg_batcher
+
+    def get_fallback_bg_session(self):
+        """Return a shared default u2net session, used when the configured model failed to load"""
+        if not self._fallback_bg_loaded:
+            with self._lock:
+                if not self._fallback_bg_loaded:
+                    import torch
+                    providers = ['CPUExecutionProvider']
+                    if torch.cuda.is_available():
+                        providers = ['CUDAExecutionProvider', 'CPUExecutionProvider']
+                    try:
+                        self._fallback_bg_session = new_session('u2net', providers=providers)
+                    except Exception:
+                        self._fallback_bg_session = new_session('u2net')
+                    self._fallback_bg_loaded = True
+        return self._fallback_bg_session
+
+    def record_detection_tier(self, tier, seconds):
+        """Count which tier of the face detection cascade produced the result"""
+        with self._lock:
+            stats = self._detection_tiers.setdefault(tier, {'count': 0, 'total_ms': 0.0})
+            stats['count'] += 1
+            stats['total_ms'] += seconds * 1000.0
+
+    def record_matting_path(self, path):
+        """Count which matting path (background model or uniform-backdrop shortcut) produced a mask"""
+        with self._lock:
+            self._matting_paths[path] = self._matting_paths.get(path, 0) + 1
+
+    def record_inference_size(self, imgsz):
+        """Count the YOLO inference size adaptive detection settled on"""
+        with self._lock:
+            key = imgsz or 'default'
+            self._inference_sizes[key] = self._inference_sizes.get(key, 0) + 1
+
+    @property
+    def ready(self):
+        """True once warm-up has loaded every model and run a dummy inference through it"""
+        return self._warm_up_state == 'ready'
+
+    def warm_up(self):
+        """Load every model and run one dummy inference through each so the first real request is fast"""
+        with self._lock:
+            if self._warm_up_state in ('running', 'ready'):
+                return self._warm_up_state == 'ready'
+            self._warm_up_state = 'running'
+            self._warm_up_error = None
+
+        started = time.monotonic()
+        try:
+            print("🔥 Warming up inference models...")
+
+            yolo_model = self.get_yolo_face_model()
+            if yolo_model is not None:
+                with self.yolo_lock:
+                    yolo_model(np.zeros((320, 320, 3), dtype=np.uint8), verbose=False)
+
+            dummy_image = Image.new('RGB', (64, 64), (255, 255, 255))
+            bg_session = self.get_bg_session() or self.get_fallback_bg_session()
+            remove(dummy_image, session=bg_session)
+
+            self.get_face_cascade().detectMultiScale(np.zeros((64, 64), dtype=np.uint8))
+
+            self._warm_up_seconds = time.monotonic() - started
+            self._warm_up_state = 'ready'
+            print(f"✓ Model warm-up finished in {self._warm_up_seconds:.1f}s")
+            return True
+        except Exception as e:
+            self._warm_up_seconds = time.monotonic() - started
+            self._warm_up_error = str(e)
+            self._warm_up_failed_at = time.monotonic()
+            self._warm_up_state = 'failed'
+            print(f"⚠️ Model warm-up failed: {e}")
+            return False
+
+    @property
+    def warm_up_failed(self):
+        return self._warm_up_state == 'failed'
+
+    def warm_up_due(self):
+        """True when no warm-up has run yet, or the last one failed long enough ago to try again"""
+        with self._lock:
+            if self._warm_up_state == 'not_started':
+                return True
+            return (
+                self._warm_up_state == 'failed'
+                and time.monotonic() - self._warm_up_failed_at >= MODEL_LOAD_RETRY_SECONDS
+            )
+
+    def status(self):
+        """Snapshot of which models are loaded in this process"""
+        with self._lock:
+            return {
+                'ready': self.ready,
+                'warm_up': {
+                    'state': self._warm_up_state,
+                    'seconds': self._warm_up_seconds,
+                    'error': self._warm_up_error,
+                },
+                'selected_gpu': self._selected_gpu if self._gpu_selected else None,
+                'yolo_face': {
+                    'loaded': self._yolo_loaded and self._yolo_face_model is not None,
+                    'model_path': self._yolo_model_path,
+                    'load_seconds': self._load_seconds.get('yolo_face'),
+                    'batching': self._face_batcher.metrics() if self._face_batcher else None,
+                    'detection_tiers': {
+                        tier: {
+                            'count': stats['count'],
+                            'avg_ms': stats['total_ms'] / stats['count'],
+                        }
+                        for tier, stats in self._detection_tiers.items()
+                    },
+                    'inference_sizes': dict(self._inference_sizes),
+                },
+                'background_removal': {
+                    'loaded': self._bg_loaded and self._bg_session is not None,
+                    'model': self._bg_model,
+                    'load_seconds': self._load_seconds.get('background_removal'),
+                    'batching': self._bg_batcher.metrics() if self._bg_batcher else None,
+                    'matting_paths': dict(self._matting_paths),
+                },
+            }
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_model_registry():
+    """Return the process-wide model registry"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = ModelRegistry()
+    return _registry
+
+
+def start_warm_up():
+    """Run model warm-up in a daemon thread so startup is not blocked
+
+    Safe to call repeatedly: nothing happens while a warm-up is running or after one succeeded, and a
+    failed warm-up is only retried once MODEL_LOAD_RETRY_SECONDS have passed. Returns the thread, or None.
+    """
+    registry = get_model_registry()
+    if not registry.warm_up_due():
+        return None
+    thread = threading.Thread(target=registry.warm_up, name='model-warm-up')
+    thread.daemon = True
+    thread.start()
+    return thread
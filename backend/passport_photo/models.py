@@ -9,6 +9,7 @@ class Country(models.Model):
     photo_height = models.IntegerField()  # in pixels
     face_height_ratio = models.FloatField(default=0.7)  # face height as ratio of total height
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)  # Last-Modified of the country list
     
     class Meta:
         verbose_name_plural = "Countries"
@@ -23,9 +24,17 @@ class PhotoProcessingJob(models.Model):
         ('completed', 'Completed'),
         ('failed', 'Failed'),
     ]
+    KIND_CHOICES = [
+        ('render', 'Render'),
+        ('analysis', 'Analysis'),
+    ]
     
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    country = models.ForeignKey(Country, on_delete=models.CASCADE)
+    # Analysis jobs run the country-independent stages before a country is chosen, so they have none
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, default='render')
+    country = models.ForeignKey(Country, on_delete=models.CASCADE, null=True, blank=True)
+    # Render jobs started from a speculative analysis reuse its mask and face instead of recomputing them
+    analysis = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='renders')
     original_photo = models.ImageField(upload_to='uploads/original/')
     processed_photo = models.ImageField(upload_to='uploads/processed/', null=True, blank=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
@@ -34,10 +43,38 @@ class PhotoProcessingJob(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     expires_at = models.DateTimeField()
     
+    # Last pipeline stage reached (decoded, background_removed, face_detected, rendered), reported in job status
+    stage = models.CharField(max_length=32, blank=True, default='')
+    
+    # Durable queue bookkeeping: a worker owns a processing job until its lease expires
+    worker_id = models.CharField(max_length=100, null=True, blank=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.IntegerField(default=0)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='job_status_created_idx'),
+        ]
+    
     def save(self, *args, **kwargs):
         if not self.expires_at:
             self.expires_at = timezone.now() + timezone.timedelta(hours=24)
         super().save(*args, **kwargs)
     
     def __str__(self):
-        return f"Job {self.id} - {self.status}"
\ No newline at end of file
+        return f"Job {self.id} - {self.status}"
+
+class PhotoOutput(models.Model):
+    """One country's rendering of a job's photo; multi-country jobs have one per requested country"""
+    job = models.ForeignKey(PhotoProcessingJob, on_delete=models.CASCADE, related_name='outputs')
+    country = models.ForeignKey(Country, on_delete=models.CASCADE)
+    processed_photo = models.ImageField(upload_to='uploads/processed/', null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['job', 'country'], name='unique_output_per_country'),
+        ]
+    
+    def __str__(self):
+        return f"Output {self.job_id} - {self.country.code}"
@@ -0,0 +1,275 @@
+import io
+import json
+import os
+import re
+import secrets
+import shutil
+import threading
+import time
+import numpy as np
+from PIL import Image
+from django.conf import settings
+from .matting import proxy_size
+from .mask_cache import source_digest
+from .services import PassportPhotoProcessor
+
+_TOKEN_PATTERN = re.compile(r'^[A-Za-z0-9_-]{16,64}$')
+
+
+class PreparedImageStore:
+    """Short-lived server-side storage of prepared (background-removed) photos, addressed by token
+
+    A session keeps the original upload bytes and the alpha mask rather than the composited image:
+    both are already compact, so preparing costs one fast PNG encode of the mask and generating one
+    decode. Sessions live in a shared directory so any web process can serve the generate call.
+    """
+
+    def __init__(self, directory, ttl_seconds):
+        self.directory = str(directory)
+        self.ttl_seconds = ttl_seconds
+
+    def create(self, source_bytes, token=None):
+        """Start a session for an upload whose analysis has not finished yet; returns its token
+
+        Analysis jobs pass their job ID as the token, and a retried job restarts its own session.
+        """
+        self.purge_expired()
+
+        token = token or secrets.token_urlsafe(24)
+        path = self._path(token)
+        os.makedirs(path, exist_ok=True)
+
+        with open(os.path.join(path, 'source'), 'wb') as f:
+            f.write(source_bytes)
+        self._write_metadata(path, {'state': 'analyzing'})
+        return token
+
+    def complete(self, token, mask, metadata):
+        """Attach the analysed mask and geometry to a session"""
+        path = self._path(token)
+        # Alpha masks are smooth; the fastest zlib level is nearly as small and several times quicker
+        Image.fromarray(mask).save(os.path.join(path, 'mask.png'), format='PNG', compress_level=1)
+        self._write_metadata(path, dict(metadata, state='ready'))
+
+    def fail(self, token, error):
+        self._write_metadata(self._path(token), {'state': 'failed', 'error': error})
+
+    def metadata(self, token):
+        """Metadata of a live session, or None if the token is unknown or expired"""
+        path = self._live_path(token)
+        if path is None:
+            return None
+        try:
+            with open(os.path.join(path, 'meta.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def read_source(self, token):
+        with open(os.path.join(self._path(token), 'source'), 'rb') as f:
+            return f.read()
+
+    def load(self, token):
+        """Return (source_bytes, mask, metadata) of a ready session, or None"""
+        path = self._live_path(token)
+        if path is None:
+            return None
+        try:
+            with open(os.path.join(path, 'meta.json')) as f:
+                metadata = json.load(f)
+            if metadata.get('state', 'ready') != 'ready':
+                return None
+            with open(os.path.join(path, 'source'), 'rb') as f:
+                source_bytes = f.read()
+            mask = np.asarray(Image.open(os.path.join(path, 'mask.png')).convert('L'))
+        except (OSError, ValueError):
+            # Purged by another process between the expiry check and the read
+            return None
+        return source_bytes, mask, metadata
+
+    def read_rendition(self, token, name):
+        """Encoded image previously rendered for a live session, or None"""
+        path = self._live_path(token)
+        if path is None:
+            return None
+        try:
+            with open(os.path.join(path, name), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def write_rendition(self, token, name, data):
+        path = self._live_path(token)
+        if path is None:
+            return
+        # Concurrent renders of the same image write identical bytes; rename keeps readers from seeing partial files
+        temp_path = os.path.join(path, f'{name}.{os.getpid()}.{threading.get_ident()}.tmp')
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, os.path.join(path, name))
+
+    def purge_expired(self):
+        if not os.path.isdir(self.directory):
+            return
+        cutoff = time.time() - self.ttl_seconds
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.is_dir() and _session_mtime(entry.path) < cutoff:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+            except OSError:
+                continue
+
+    def _write_metadata(self, path, metadata):
+        # Readers poll meta.json, so it is replaced atomically
+        temp_path = os.path.join(path, f'meta.json.{os.getpid()}.{threading.get_ident()}.tmp')
+        with open(temp_path, 'w') as f:
+            json.dump(metadata, f)
+        os.replace(temp_path, os.path.join(path, 'meta.json'))
+
+    def _path(self, token):
+        return os.path.join(self.directory, token)
+
+    def _live_path(self, token):
+        # Tokens become path components, so anything but the token alphabet is rejected outright
+        if not isinstance(token, str) or not _TOKEN_PATTERN.match(token):
+            return None
+        path = self._path(token)
+        try:
+            # Age is taken from meta.json rather than the directory, so adding renditions never extends a session
+            if os.stat(os.path.join(path, 'meta.json')).st_mtime < time.time() - self.ttl_seconds:
+                return None
+        except OSError:
+            return None
+        return path
+
+
+def _session_mtime(path):
+    # A directory without meta.json is a session whose creation is still in progress or failed
+    try:
+        return os.stat(os.path.join(path, 'meta.json')).st_mtime
+    except OSError:
+        return os.stat(path).st_mtime
+
+
+_prepared_store = None
+_prepared_store_lock = threading.Lock()
+
+
+def get_prepared_store():
+    """Return the process-wide prepared image store"""
+    global _prepared_store
+    if _prepared_store is None:
+        with _prepared_store_lock:
+            if _prepared_store is None:
+                session_settings = settings.PASSPORT_PHOTO_SETTINGS.get('PREPARED_SESSIONS', {})
+                _prepared_store = PreparedImageStore(
+                    session_settings.get('DIRECTORY'),
+                    session_settings.get('TTL_SECONDS', 1800),
+                )
+    return _prepared_store
+
+
+def analyze_session(token, processor=None):
+    """Pre-flight, background removal and face detection for a session's upload
+
+    Country-independent, so it can start as soon as the photo arrives; the outcome (geometry, or
+    the user-facing error) is recorded on the session and returned as its metadata.
+    """
+    store = get_prepared_store()
+    try:
+        processor = processor or PassportPhotoProcessor()
+        source_bytes = store.read_source(token)
+        # Same capped working size as create_passport_photos, so both paths find the same face;
+        # the mask is stored at this size and only generate brings it to full resolution
+        image = processor.load_image(source_bytes)
+        width, height = source_size(source_bytes)
+        working_scale = max(image.size) / max(width, height)
+
+        # Reject hopeless uploads before paying for background removal
+        preflight = processor.preflight_check(image)
+
+        mask = processor.remove_background_mask(image, source_digest(source_bytes))
+        no_bg_image = processor.apply_alpha_mask(image, mask)
+        face = processor.select_single_face(processor.detect_face(no_bg_image))
+
+        # The editor only gets a screen-sized preview; geometry sent to it is scaled by preview_scale
+        preview_max_dimension = settings.PASSPORT_PHOTO_SETTINGS.get('PREPARED_SESSIONS', {}).get('PREVIEW_MAX_DIMENSION')
+        _, preview_scale = proxy_size((width, height), preview_max_dimension)
+
+        # Geometry is recorded in full-resolution pixels; working_scale maps it back to the mask
+        metadata = {
+            'width': width,
+            'height': height,
+            'working_scale': working_scale,
+            'preview_scale': preview_scale,
+            'face': {
+                'bbox': [int(round(value / working_scale)) for value in face['bbox']],
+                'confidence': float(face['confidence']),
+                'method': face['method'],
+                'inference_size': face.get('inference_size'),
+            },
+            'preflight': preflight,
+            'matting': processor.last_matting_path,
+        }
+        store.complete(token, mask, metadata)
+        return dict(metadata, state='ready')
+    except Exception as e:
+        store.fail(token, str(e))
+        return {'state': 'failed', 'error': str(e)}
+
+
+def analyze_job_session(token, source_bytes, processor=None):
+    """Analyse a queued analysis job's upload into its session; raises with the user-facing error
+
+    analyze_photo starts the session when it queues the job; it is started again here if it has
+    expired since, or if the worker does not share the web process's session directory.
+    """
+    store = get_prepared_store()
+    if store.metadata(token) is None:
+        store.create(source_bytes, token)
+    metadata = analyze_session(token, processor)
+    if metadata['state'] == 'failed':
+        raise ValueError(metadata['error'])
+    return metadata
+
+
+def source_size(source_bytes):
+    """(width, height) of an upload once EXIF orientation is applied, without decoding the pixels"""
+    with Image.open(io.BytesIO(source_bytes)) as image:
+        width, height = image.size
+        # Orientations 5 to 8 rotate the photo by 90 degrees
+        if image.getexif().get(0x0112) in (5, 6, 7, 8):
+            width, height = height, width
+    return width, height
+
+
+def session_image(source_bytes, mask, processor, full_resolution=False):
+    """Background-removed image of a session, at the analysis working size or at full resolution
+
+    Sessions keep the mask at the working size; only generating the final crop needs the upload's
+    full resolution, and pays for upsampling the mask to it.
+    """
+    if not full_resolution:
+        return processor.apply_alpha_mask(processor.load_image(source_bytes), mask)
+    image = processor.load_image(source_bytes, max_dimension=None)
+    return processor.apply_alpha_mask(image, processor._upsample_mask(mask, image))
+
+
+def render_session(token, country_specs, processor=None):
+    """Automatic-mode passport photo for one country from an analysed session, or None if it is gone"""
+    prepared = get_prepared_store().load(token)
+    if prepared is None:
+        return None
+
+    source_bytes, mask, metadata = prepared
+    processor = processor or PassportPhotoProcessor()
+    image = session_image(source_bytes, mask, processor)
+    working_scale = metadata.get('working_scale', 1.0)
+    analysis = {
+        'image': image,
+        'face': dict(metadata['face'], bbox=tuple(value * working_scale for value in metadata['face']['bbox'])),
+        'offset': (0, 0),
+        'source_size': image.size,
+        'pipeline': 'speculative',
+    }
+    return processor.render_passport_photo(analysis, country_specs)
@@ -0,0 +1,61 @@
+import threading
+from django.utils import timezone
+from .models import PhotoProcessingJob
+
+
+class ProgressBroadcaster:
+    """Wakes long-polling status requests in this process as soon as a job they watch changes
+
+    Every change is also written to the job row, which is what requests served by other processes
+    (or watching jobs run by dedicated workers) fall back to checking.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        # Only jobs with a waiting request are tracked: job_id -> [version, watcher count]
+        self._watched = {}
+
+    def watch(self, job_id):
+        """Start tracking a job; returns its current version for wait()"""
+        with self._condition:
+            entry = self._watched.setdefault(job_id, [0, 0])
+            entry[1] += 1
+            return entry[0]
+
+    def unwatch(self, job_id):
+        with self._condition:
+            entry = self._watched.get(job_id)
+            if entry:
+                entry[1] -= 1
+                if entry[1] <= 0:
+                    del self._watched[job_id]
+
+    def publish(self, job_id):
+        with self._condition:
+            entry = self._watched.get(job_id)
+            if entry:
+                entry[0] += 1
+                self._condition.notify_all()
+
+    def wait(self, job_id, version, timeout):
+        """Block until a watched job's version moves past version or timeout passes; returns the current version"""
+        with self._condition:
+            self._condition.wait_for(lambda: self._version(job_id) != version, timeout)
+            return self._version(job_id)
+
+    def _version(self, job_id):
+        entry = self._watched.get(job_id)
+        return entry[0] if entry else 0
+
+
+_broadcaster = ProgressBroadcaster()
+
+
+def get_progress_broadcaster():
+    return _broadcaster
+
+
+def record_stage(job_id, stage):
+    """Persist the pipeline stage a job has reached and wake local requests waiting on it"""
+    PhotoProcessingJob.objects.filter(id=job_id).update(stage=stage, updated_at=timezone.now())
+    _broadcaster.publish(job_id)
@@ -1,30 +1,75 @@
 from rest_framework import serializers
-from .models import Country, PhotoProcessingJob
+from .models import Country, PhotoProcessingJob, PhotoOutput
+from .job_queue import queue_position
 
 class CountrySerializer(serializers.ModelSerializer):
     class Meta:
         model = Country
         fields = ['id', 'name', 'code', 'photo_width', 'photo_height', 'face_height_ratio']
 
+class PhotoAnalysisSerializer(serializers.Serializer):
+    photo = serializers.ImageField()
+
 class PhotoUploadSerializer(serializers.Serializer):
+    # Either the photo itself or the analysis_id returned by the analyze endpoint
+    photo = serializers.ImageField(required=False)
+    analysis_id = serializers.CharField(required=False, max_length=64)
+    # Validated into the Country itself (validated_data['country']), so views don't look it up again
+    country_id = serializers.PrimaryKeyRelatedField(
+        queryset=Country.objects.all(),
+        source='country',
+        error_messages={'does_not_exist': 'Invalid country ID', 'incorrect_type': 'Invalid country ID'},
+    )
+    
+    def validate(self, attrs):
+        if not attrs.get('photo') and not attrs.get('analysis_id'):
+            raise serializers.ValidationError({'photo': 'A photo or an analysis_id is required.'})
+        return attrs
+
+class MultiCountryUploadSerializer(serializers.Serializer):
     photo = serializers.ImageField()
-    country_id = serializers.IntegerField()
+    country_ids = serializers.ListField(child=serializers.IntegerField(), min_length=1, max_length=10)
     
-    def validate_country_id(self, value):
-        try:
-            Country.objects.get(id=value)
-            return value
-        except Country.DoesNotExist:
-            raise serializers.ValidationError("Invalid country ID")
+    def validate_country_ids(self, value):
+        # Keep the requested order (the first country is the job's primary one) but drop repeats
+        value = list(dict.fromkeys(value))
+        countries = Country.objects.in_bulk(value)
+        missing = [country_id for country_id in value if country_id not in countries]
+        if missing:
+            raise serializers.ValidationError(f"Invalid country ID(s): {', '.join(map(str, missing))}")
+        return [countries[country_id] for country_id in value]
+
+class PhotoOutputSerializer(serializers.ModelSerializer):
+    country = CountrySerializer(read_only=True)
+    processed_photo_url = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = PhotoOutput
+        fields = ['country', 'processed_photo_url']
+    
+    def get_processed_photo_url(self, obj):
+        if obj.processed_photo:
+            request = self.context.get('request')
+            if request:
+                return request.build_absolute_uri(obj.processed_photo.url)
+        return None
 
 class PhotoProcessingJobSerializer(serializers.ModelSerializer):
     country = CountrySerializer(read_only=True)
     processed_photo_url = serializers.SerializerMethodField()
+    queue_position = serializers.SerializerMethodField()
+    outputs = PhotoOutputSerializer(many=True, read_only=True)
     
     class Meta:
         model = PhotoProcessingJob
-        fields = ['id', 'country', 'status', 'error_message', 'created_at', 
-                 'updated_at', 'processed_photo_url']
+        fields = ['id', 'kind', 'country', 'status', 'stage', 'error_message', 'created_at', 
+                 'updated_at', 'processed_photo_url', 'queue_position', 'outputs']
+    
+    def get_queue_position(self, obj):
+        # Views that already looked the position up pass it in to save the query
+        if 'queue_position' in self.context:
+            return self.context['queue_position']
+        return queue_position(obj)
     
     def get_processed_photo_url(self, obj):
         if obj.processed_photo and obj.status == 'completed':
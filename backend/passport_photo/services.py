@@ -1,138 +1,224 @@
 import cv2
 import numpy as np
 from PIL import Image, ImageEnhance, ImageOps
-from rembg import remove, new_session
-from ultralytics import YOLO
 import io
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from django.core.files.base import ContentFile
 from django.conf import settings
+from .model_registry import get_model_registry
+from .face_batching import boxes_to_arrays, filter_face_boxes
+from .matting import make_proxy, upsample_mask
+from .backdrop import analyze_backdrop, backdrop_mask
+from .mask_cache import get_mask_cache, mask_cache_key, source_digest
+
+_stage_pool = None
+_stage_pool_lock = threading.Lock()
+
+def get_stage_pool():
+    """Shared thread pool for pipeline stages that run alongside background removal"""
+    global _stage_pool
+    if _stage_pool is None:
+        with _stage_pool_lock:
+            if _stage_pool is None:
+                max_workers = settings.PASSPORT_PHOTO_SETTINGS.get('STAGE_POOL_WORKERS', 4)
+                _stage_pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='pipeline-stage')
+    return _stage_pool
 
 class PassportPhotoProcessor:
     def __init__(self):
-        # Auto select best GPU for models
-        self.selected_gpu = self._auto_select_gpu()
+        # Models are loaded once per process and shared across requests
+        self.registry = get_model_registry()
+        self.selected_gpu = self.registry.selected_gpu
+        self.yolo_face_model = self.registry.get_yolo_face_model()
+        
+        # The background removal session is fetched from the registry on first use
+        self._bg_model = self.registry.bg_model_name
+        
+        # Which matting path produced the most recent mask ('model', 'uniform_backdrop' or 'cache')
+        self.last_matting_path = None
+        
+        # Optional callable notified with each pipeline stage reached (reported in job status)
+        self.progress = None
+    
+    def _report(self, stage):
+        if self.progress:
+            self.progress(stage)
+    
+    def load_image(self, image_bytes, max_dimension=3000):
+        """Decode an upload once: EXIF orientation, optional downscale and RGB conversion"""
+        # Load and preprocess image
+        image = Image.open(io.BytesIO(image_bytes))
+        
+        # Handle EXIF orientation (important for camera photos)
+        image = ImageOps.exif_transpose(image)
+        
+        # Handle large images - resize if too big for performance
+        if max_dimension and max(image.size) > max_dimension:
+            ratio = max_dimension / max(image.size)
+            new_size = (int(image.size[0] * ratio), int(image.size[1] * ratio))
+            image = image.resize(new_size, Image.Resampling.LANCZOS)
+            print(f"📏 Resized large image to {new_size[0]}×{new_size[1]} for processing")
         
-        # Load YapaLab YOLO-face model for accurate face detection
-        model_path = settings.PASSPORT_PHOTO_SETTINGS.get('YOLO_FACE_MODEL_PATH', '/tmp/yolov8n-face.pt')
+        # Convert to RGB if needed (handle various formats)
+        if image.mode in ('RGBA', 'LA'):
+            # Create white background for transparent images
+            rgb_image = Image.new('RGB', image.size, (255, 255, 255))
+            if image.mode == 'RGBA':
+                rgb_image.paste(image, mask=image.split()[3])
+            else:  # LA mode
+                rgb_image.paste(image, mask=image.split()[1])
+            image = rgb_image
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
         
+        return image
+    
+    def remove_background_mask(self, image, source=None, crop=None):
+        """Predict the foreground alpha mask (uint8 array, same size as image) for an RGB image
+
+        source is the upload's source_digest; with it the mask cache is used. The cache holds the
+        mask at model resolution, so every working resolution of a photo (capped in automatic mode,
+        full size in sessions) shares one entry. crop is (box, frame_size) when image was cropped
+        from a larger frame: a cached whole-frame mask is cropped to match, and on a miss only the
+        crop is computed and nothing is stored.
+        """
         try:
-            # Try YapaLab face model first (most accurate)
-            self.yolo_face_model = YOLO(model_path)
-            if self.selected_gpu is not None:
-                self.yolo_face_model.to(f'cuda:{self.selected_gpu}')
-            print(f"✓ Loaded YapaLab YOLOv8n-face model from {model_path} on GPU {self.selected_gpu}")
+            cache = get_mask_cache() if source else None
+            cache_key = mask_cache_key(source, self._bg_model) if cache else None
+            cached = cache.get(cache_key) if cache else None
+            
+            if cached is not None:
+                # Re-uploads of the same photo (retries, other countries, other modes) reuse the stored mask
+                print("♻️ Reusing cached background mask")
+                self.last_matting_path = 'cache'
+                self.registry.record_matting_path(self.last_matting_path)
+                if crop is not None:
+                    cached = self._crop_mask(cached, *crop)
+                return self._upsample_mask(cached, image)
+            
+            proxy = self._model_proxy(image)
+            mask = self._compute_mask(proxy)
+            if cache and crop is None:
+                cache.put(cache_key, mask)
+            return self._upsample_mask(mask, image, proxy)
         except Exception as e:
-            print(f"Failed to load YapaLab face model from {model_path}: {e}")
-            try:
-                # Fallback to standard YOLO
-                self.yolo_face_model = YOLO('yolov8n.pt')
-                if self.selected_gpu is not None:
-                    self.yolo_face_model.to(f'cuda:{self.selected_gpu}')
-                print(f"✓ Loaded standard YOLOv8n model as fallback on GPU {self.selected_gpu}")
-            except Exception as e2:
-                print(f"Failed to load any YOLO model: {e2}")
-                self.yolo_face_model = None
-        
-        # Lazy load background removal session (initialize on first use)
-        self.bg_removal_session = None
-        self._bg_model = settings.PASSPORT_PHOTO_SETTINGS.get('BACKGROUND_REMOVAL_MODEL', 'u2net')
-        self._bg_session_initialized = False
-
-    def _auto_select_gpu(self):
-        """Auto select best GPU: prefer GPU 1 if available with >2GB free, fallback to GPU 0"""
-        import torch
-        if not torch.cuda.is_available():
-            print("🚫 No CUDA GPUs available, using CPU")
+            raise Exception(f"Background removal failed: {str(e)}")
+    
+    def _model_proxy(self, image):
+        # The model works at a fixed internal resolution, so optionally feed it a downscaled proxy
+        # and upsample only the predicted alpha back to the working resolution
+        proxy_settings = settings.PASSPORT_PHOTO_SETTINGS.get('BACKGROUND_REMOVAL_PROXY', {})
+        if proxy_settings.get('ENABLED', False):
+            return make_proxy(image, proxy_settings.get('MAX_DIMENSION', 1024))[0]
+        return image
+    
+    def _compute_mask(self, proxy):
+        """Run the matting path (uniform-backdrop shortcut or background model) at model resolution"""
+        # A plain, light backdrop can be segmented by colour alone; otherwise run the model
+        mask = self._uniform_backdrop_mask(proxy)
+        if mask is None:
+            mask = self._predict_mask(proxy)
+            self.last_matting_path = 'model'
+        else:
+            self.last_matting_path = 'uniform_backdrop'
+        self.registry.record_matting_path(self.last_matting_path)
+        return mask
+    
+    def _crop_mask(self, mask, box, frame_size):
+        """The part of a whole-frame mask covering box (in frame_size pixels)"""
+        scale_x = mask.shape[1] / frame_size[0]
+        scale_y = mask.shape[0] / frame_size[1]
+        left, top, right, bottom = box
+        x1, y1 = int(left * scale_x), int(top * scale_y)
+        x2 = max(x1 + 1, int(np.ceil(right * scale_x)))
+        y2 = max(y1 + 1, int(np.ceil(bottom * scale_y)))
+        return mask[y1:y2, x1:x2]
+    
+    def _upsample_mask(self, mask, image, proxy=None):
+        """Bring a model-resolution mask to image's size, refining edges against the image"""
+        if mask.shape == (image.height, image.width):
+            return mask
+        
+        proxy_settings = settings.PASSPORT_PHOTO_SETTINGS.get('BACKGROUND_REMOVAL_PROXY', {})
+        if not proxy_settings.get('REFINE_EDGES', True):
+            proxy = None
+        elif proxy is None or proxy.size != (mask.shape[1], mask.shape[0]):
+            # A cached mask: the guide is the working image brought down to the mask's size
+            proxy = image.resize((mask.shape[1], mask.shape[0]), Image.Resampling.BILINEAR, reducing_gap=2.0)
+        return upsample_mask(
+            mask, image,
+            proxy=proxy,
+            radius=proxy_settings.get('REFINE_RADIUS', 8),
+            eps=proxy_settings.get('REFINE_EPS', 1e-3),
+        )
+    
+    def _uniform_backdrop_mask(self, image):
+        """Cheap alpha mask for photos already shot against a plain light backdrop, or None"""
+        backdrop = settings.PASSPORT_PHOTO_SETTINGS.get('UNIFORM_BACKDROP', {})
+        if not backdrop.get('ENABLED', False):
             return None
         
-        try:
-            gpu_info = []
-            for i in range(torch.cuda.device_count()):
-                gpu_name = torch.cuda.get_device_name(i)
-                torch.cuda.set_device(i)
-                total_mem = torch.cuda.get_device_properties(i).total_memory / (1024**3)
-                free_mem, _ = torch.cuda.mem_get_info()
-                free_mem_gb = free_mem / (1024**3)
-                gpu_info.append({
-                    'id': i, 
-                    'name': gpu_name, 
-                    'free_mem_gb': free_mem_gb,
-                    'total_mem_gb': total_mem
-                })
-            
-            # Select GPU 1 if available and has >2GB free memory, otherwise use GPU 0
-            if len(gpu_info) > 1 and gpu_info[1]['free_mem_gb'] > 2.0:
-                selected_gpu = 1
-                print(f"🎮 Auto-selected GPU 1: {gpu_info[1]['name']} ({gpu_info[1]['free_mem_gb']:.1f}GB free)")
-            else:
-                selected_gpu = 0
-                if len(gpu_info) > 0:
-                    print(f"🎮 Using GPU 0: {gpu_info[0]['name']} ({gpu_info[0]['free_mem_gb']:.1f}GB free)")
-            
-            return selected_gpu
-            
-        except Exception as e:
-            print(f"⚠️ GPU selection error, using GPU 0: {e}")
-            return 0
+        tolerance = backdrop.get('TOLERANCE', 18.0)
+        stats = analyze_backdrop(image, backdrop.get('BORDER_RATIO', 0.06), tolerance)
+        if (stats['coverage'] < backdrop.get('MIN_COVERAGE', 0.98)
+                or stats['brightness'] < backdrop.get('MIN_BRIGHTNESS', 200.0)
+                or stats['tint'] > backdrop.get('MAX_TINT', 20.0)
+                or stats['gradient'] > backdrop.get('MAX_GRADIENT', 6.0)):
+            return None
+        
+        mask, silhouette = backdrop_mask(image, stats['color'], tolerance)
+        
+        # An implausible silhouette, shoulders missing from the bottom edge or anything but backdrop at the
+        # top and upper sides means the threshold leaked into the subject or kept something it shouldn't
+        min_foreground, max_foreground = backdrop.get('FOREGROUND_RANGE', (0.1, 0.85))
+        if not min_foreground <= silhouette['foreground'] <= max_foreground:
+            return None
+        if silhouette['shoulders'] < backdrop.get('MIN_SHOULDER_RATIO', 0.3):
+            return None
+        if silhouette['edge_contact'] > backdrop.get('MAX_EDGE_CONTACT', 0.0):
+            return None
+        # A shadow on the wall would be kept fully opaque and end up in the passport photo
+        if silhouette['shadow'] > backdrop.get('MAX_SHADOW_RATIO', 0.002):
+            return None
+        
+        print(f"⬜ Uniform backdrop (coverage {stats['coverage']:.0%}, foreground {silhouette['foreground']:.0%}); skipping background model")
+        return mask
     
-    def _initialize_bg_session(self):
-        """Initialize background removal session on first use with GPU acceleration"""
-        if not self._bg_session_initialized:
-            self._bg_session_initialized = True
-            
-            # Setup GPU providers for acceleration using pre-selected GPU
-            import torch
-            providers = ['CPUExecutionProvider']
-            if torch.cuda.is_available() and self.selected_gpu is not None:
-                # Use the GPU selected during initialization
-                provider_options = {
-                    'device_id': self.selected_gpu,
-                    'arena_extend_strategy': 'kSameAsRequested',
-                    'gpu_mem_limit': 20 * 1024 * 1024 * 1024,  # 20GB limit
-                    'cudnn_conv_algo_search': 'EXHAUSTIVE'
-                }
-                providers = [('CUDAExecutionProvider', provider_options), 'CPUExecutionProvider']
-                print(f"🔄 Using GPU {self.selected_gpu} for BiRefNet background removal")
-            
-            try:
-                print(f"🔄 Initializing {self._bg_model} background removal model with providers: {providers}")
-                self.bg_removal_session = new_session(self._bg_model, providers=providers)
-                print(f"✓ Loaded {self._bg_model} background removal model with GPU acceleration")
-            except Exception as e:
-                print(f"⚠️ Failed to load {self._bg_model} model with GPU, falling back to CPU: {e}")
-                try:
-                    self.bg_removal_session = new_session(self._bg_model, providers=['CPUExecutionProvider'])
-                    print(f"✓ Loaded {self._bg_model} background removal model (CPU fallback)")
-                except Exception as e2:
-                    print(f"⚠️ Failed to load {self._bg_model} model, using default u2net: {e2}")
-                    self.bg_removal_session = None
+    def _predict_mask(self, image):
+        """Run the background model on an RGB image and return its uint8 mask at the same size"""
+        # Share a forward pass with concurrent requests when micro-batching is enabled
+        batcher = self.registry.get_bg_batcher()
+        if batcher:
+            mask = batcher.predict_mask(image)
+        else:
+            # Use configured background removal model, or the shared default u2net session
+            session = self.registry.get_bg_session() or self.registry.get_fallback_bg_session()
+            mask = session.predict(image)[0]
+        
+        return np.asarray(mask, dtype=np.uint8)
+    
+    def apply_alpha_mask(self, image, mask):
+        """Attach a background-removal mask to an RGB image as its alpha channel"""
+        cutout = image.convert('RGBA')
+        cutout.putalpha(Image.fromarray(mask))
+        return cutout
     
     def remove_background(self, image_bytes):
-        """Remove background from image using configured rembg model with GPU acceleration"""
+        """Remove background from encoded image bytes and return PNG bytes (for scripts and tools)"""
         try:
-            # Initialize session on first use (lazy loading)
-            self._initialize_bg_session()
-            
-            # Use configured background removal model
-            if self.bg_removal_session:
-                # Use specific model session with GPU acceleration
-                output = remove(image_bytes, session=self.bg_removal_session)
-            else:
-                # Use default u2net model with GPU if available
-                import torch
-                if torch.cuda.is_available():
-                    providers = ['CUDAExecutionProvider', 'CPUExecutionProvider']
-                    try:
-                        u2net_session = new_session('u2net', providers=providers)
-                        output = remove(image_bytes, session=u2net_session)
-                    except:
-                        # Fallback to default if GPU session fails
-                        output = remove(image_bytes)
-                else:
-                    output = remove(image_bytes)
-            return output
+            image = ImageOps.exif_transpose(Image.open(io.BytesIO(image_bytes)))
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
         except Exception as e:
             raise Exception(f"Background removal failed: {str(e)}")
+        
+        cutout = self.apply_alpha_mask(image, self.remove_background_mask(image, source_digest(image_bytes)))
+        
+        output = io.BytesIO()
+        cutout.save(output, format='PNG')
+        return output.getvalue()
     
     def detect_face(self, image):
         """Detect face using best available method: YapaLab YOLO-face > OpenCV Haar > YOLO person"""
@@ -145,11 +231,20 @@ class PassportPhotoProcessor:
             elif image.mode != 'RGB':
                 image = image.convert('RGB')
             
+            started = time.monotonic()
+            
             # Try YapaLab YOLO-face first (most accurate for faces)
+            predictions = None
+            inference_size = None
             if self.yolo_face_model:
                 try:
-                    faces = self._detect_face_yolo_face(image)
+                    # Adaptive-size YOLO pass; the last fallback tier re-filters these raw predictions
+                    predictions, inference_size = self._predict_yolo_adaptive(image)
+                    faces = self._detect_face_yolo_face(image, predictions)
+                    for face in faces:
+                        face['inference_size'] = inference_size
                     if faces:
+                        self.registry.record_detection_tier('yolo_face', time.monotonic() - started)
                         return faces
                     print('YapaLab YOLO-face found no faces, trying OpenCV...')
                 except Exception as e:
@@ -158,17 +253,22 @@ class PassportPhotoProcessor:
             # Fallback to OpenCV Haar Cascade
             faces = self._detect_face_opencv(image)
             if faces:
+                self.registry.record_detection_tier('opencv_haar', time.monotonic() - started)
                 return faces
             print('OpenCV found no faces, falling back to YOLO person detection...')
             
             # Final fallback to YOLO person detection
-            return self._detect_face_yolo_fallback(image)
+            faces = self._detect_face_yolo_fallback(image, predictions)
+            for face in faces:
+                face['inference_size'] = inference_size
+            self.registry.record_detection_tier('yolo_person' if faces else 'none', time.monotonic() - started)
+            return faces
             
         except Exception as e:
             print(f'All face detection methods failed: {e}')
             raise Exception(f"Face detection failed: {str(e)}")
     
-    def _detect_face_yolo_face(self, image):
+    def _detect_face_yolo_face(self, image, predictions=None):
         """Detect face using YapaLab YOLO-face model (most accurate)"""
         try:
             # Ensure image is RGB (YOLO expects 3 channels, not RGBA)
@@ -179,40 +279,27 @@ class PassportPhotoProcessor:
             elif image.mode != 'RGB':
                 image = image.convert('RGB')
             
-            # Convert PIL image to numpy array
-            img_array = np.array(image)
-            
-            # Run YapaLab YOLO-face inference
-            results = self.yolo_face_model(img_array)
+            # Run YapaLab YOLO-face inference (batched with concurrent requests when enabled)
+            if predictions is None:
+                predictions = self._predict_yolo(np.asarray(image))
+            xyxy, conf = predictions
+            
+            # YOLO-face should have high confidence for actual faces; validate aspect ratio and size
+            min_confidence = settings.PASSPORT_PHOTO_SETTINGS.get('FACE_DETECTION_CONFIDENCE', {}).get('YOLO_FACE', 0.3)
+            xyxy, conf = filter_face_boxes(
+                xyxy, conf, image.size, min_confidence,
+                aspect_range=(0.5, 2.0),   # Reasonable face aspect ratio
+                area_range=(0.005, 0.8),   # Face should be reasonable size
+            )
             
-            faces = []
-            for result in results:
-                boxes = result.boxes
-                if boxes is not None:
-                    for box in boxes:
-                        # Get bounding box coordinates
-                        x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
-                        confidence = box.conf[0].cpu().numpy()
-                        
-                        # YOLO-face should have high confidence for actual faces
-                        min_confidence = settings.PASSPORT_PHOTO_SETTINGS.get('FACE_DETECTION_CONFIDENCE', {}).get('YOLO_FACE', 0.3)
-                        if confidence > min_confidence:
-                            face_width = x2 - x1
-                            face_height = y2 - y1
-                            aspect_ratio = face_width / face_height
-                            
-                            # Validate face dimensions
-                            if 0.5 <= aspect_ratio <= 2.0:  # Reasonable face aspect ratio
-                                img_area = image.width * image.height
-                                face_area = face_width * face_height
-                                area_ratio = face_area / img_area
-                                
-                                if 0.005 <= area_ratio <= 0.8:  # Face should be reasonable size
-                                    faces.append({
-                                        'bbox': (int(x1), int(y1), int(x2), int(y2)),
-                                        'confidence': float(confidence),
-                                        'method': 'yolo_face'
-                                    })
+            faces = [
+                {
+                    'bbox': (int(x1), int(y1), int(x2), int(y2)),
+                    'confidence': float(confidence),
+                    'method': 'yolo_face'
+                }
+                for (x1, y1, x2, y2), confidence in zip(xyxy, conf)
+            ]
             
             # Sort by confidence and return the best face
             if faces:
@@ -224,27 +311,73 @@ class PassportPhotoProcessor:
         except Exception as e:
             raise Exception(f"YOLO-face detection failed: {str(e)}")
     
+    def _predict_yolo(self, img_array, imgsz=None):
+        """Raw (xyxy, conf) detections for one image, via the shared batcher when enabled
+        
+        Ultralytics letterboxes to imgsz and scales boxes back to img_array's coordinates.
+        """
+        batcher = self.registry.get_face_batcher()
+        if batcher:
+            return batcher.predict(img_array, imgsz)
+        
+        kwargs = {'imgsz': imgsz} if imgsz else {}
+        with self.registry.yolo_lock:
+            results = self.yolo_face_model(img_array, verbose=False, **kwargs)
+        return boxes_to_arrays(results[0])
+    
+    def _predict_yolo_adaptive(self, image):
+        """Run YOLO at the smallest configured size that finds a confident face; returns (predictions, size)"""
+        img_array = np.asarray(image)
+        sizes = settings.PASSPORT_PHOTO_SETTINGS.get('YOLO_INFERENCE_SIZES') or [None]
+        escalate_below = settings.PASSPORT_PHOTO_SETTINGS.get('YOLO_ESCALATE_CONFIDENCE', 0.5)
+        
+        # Escalation can do worse than a smaller size did, so the most confident face seen is kept
+        # (ties, including no face at all, go to the larger size)
+        best = None  # (confidence, predictions, size)
+        for imgsz in sizes:
+            predictions = self._predict_yolo(img_array, imgsz)
+            faces = self._detect_face_yolo_face(image, predictions)
+            confidence = faces[0]['confidence'] if faces else -1.0
+            if best is None or confidence >= best[0]:
+                best = (confidence, predictions, imgsz)
+            if confidence >= escalate_below:
+                break
+            if imgsz != sizes[-1]:
+                print(f'No confident face at {imgsz}px, escalating YOLO inference size...')
+        
+        _, predictions, imgsz = best
+        self.registry.record_inference_size(imgsz)
+        return predictions, imgsz
+    
     def _detect_face_opencv(self, image):
         """Detect face using OpenCV Haar Cascade"""
         try:
-            # Convert PIL image to OpenCV format
-            cv_image = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-            gray = cv2.cvtColor(cv_image, cv2.COLOR_BGR2GRAY)
+            # Convert PIL image to grayscale for OpenCV
+            gray = cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2GRAY)
+            
+            # Run the cascade on a downscaled copy so its cost doesn't grow with camera resolution
+            max_dimension = settings.PASSPORT_PHOTO_SETTINGS.get('HAAR_MAX_DIMENSION', 800)
+            detect_scale = min(1.0, max_dimension / max(gray.shape))
+            if detect_scale < 1.0:
+                gray = cv2.resize(gray, None, fx=detect_scale, fy=detect_scale, interpolation=cv2.INTER_AREA)
+            
+            # Faces smaller than 1% of the frame are rejected below, so don't search for them
+            min_side = max(24, int(0.08 * np.sqrt(gray.shape[0] * gray.shape[1])))
             
-            # Use OpenCV Haar Cascade for face detection
-            face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+            # Use this thread's cached OpenCV Haar Cascade for face detection
+            face_cascade = self.registry.get_face_cascade()
             
             # Detect faces with different parameters for better accuracy
             opencv_faces = face_cascade.detectMultiScale(
                 gray,
                 scaleFactor=1.1,
                 minNeighbors=5,
-                minSize=(50, 50),  # Minimum face size
+                minSize=(min_side, min_side),  # Minimum face size
                 flags=cv2.CASCADE_SCALE_IMAGE
             )
             
             faces = []
-            for (x, y, w, h) in opencv_faces:
+            for (x, y, w, h) in np.asarray(opencv_faces).reshape(-1, 4) / detect_scale:
                 # Convert to our format
                 x1, y1, x2, y2 = x, y, x + w, y + h
                 
@@ -278,39 +411,27 @@ class PassportPhotoProcessor:
         except Exception as e:
             raise Exception(f"OpenCV face detection failed: {str(e)}")
     
-    def _detect_face_yolo_fallback(self, image):
+    def _detect_face_yolo_fallback(self, image, predictions=None):
         """Fallback YOLO person detection with head estimation"""
         try:
-            # Convert PIL image to numpy array
-            img_array = np.array(image)
-            
-            # Run YOLO inference (using the fallback model)
-            results = self.yolo_face_model(img_array)
+            # Re-filter the first pass's predictions with looser thresholds; only infer if there were none
+            if predictions is None:
+                predictions = self._predict_yolo(np.asarray(image))
+            xyxy, conf = predictions
+            xyxy, conf = filter_face_boxes(
+                xyxy, conf, image.size, 0.5,
+                aspect_range=(0.3, 2.0),
+                area_range=(0.0, 0.8),
+            )
             
-            faces = []
-            for result in results:
-                boxes = result.boxes
-                if boxes is not None:
-                    for box in boxes:
-                        x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
-                        confidence = box.conf[0].cpu().numpy()
-                        
-                        if confidence > 0.5:
-                            face_width = x2 - x1
-                            face_height = y2 - y1
-                            aspect_ratio = face_width / face_height
-                            
-                            if 0.3 <= aspect_ratio <= 2.0:
-                                img_area = image.width * image.height
-                                face_area = face_width * face_height
-                                area_ratio = face_area / img_area
-                                
-                                if area_ratio <= 0.8:
-                                    faces.append({
-                                        'bbox': (int(x1), int(y1), int(x2), int(y2)),
-                                        'confidence': float(confidence),
-                                        'method': 'yolo_person'
-                                    })
+            faces = [
+                {
+                    'bbox': (int(x1), int(y1), int(x2), int(y2)),
+                    'confidence': float(confidence),
+                    'method': 'yolo_person'
+                }
+                for (x1, y1, x2, y2), confidence in zip(xyxy, conf)
+            ]
             
             return faces
         except Exception as e:
@@ -374,6 +495,59 @@ class PassportPhotoProcessor:
             'face_center': (face_center_x, face_center_y)
         }
     
+    def default_selection(self, face, image_size, country_specs, output_scale=1.0):
+        """Crop rectangle automatic mode would use for one country, in image pixels times output_scale"""
+        image_width, image_height = image_size
+        target_width = country_specs['photo_width']
+        target_height = country_specs['photo_height']
+        
+        # Use the same calculation as automatic mode
+        positioning_data = self.calculate_optimal_scale_and_position(
+            face['bbox'],
+            image_size,
+            (target_width, target_height),
+            country_specs['face_height_ratio'],
+            country_specs.get('country_code'),
+            face['method']
+        )
+        
+        scale = positioning_data['scale']
+        target_head_center = positioning_data['target_head_center']
+        face_center = positioning_data['face_center']
+        
+        # Calculate the cropping area that would be used in automatic mode
+        scaled_img_width = image_width * scale
+        scaled_img_height = image_height * scale
+        
+        # Calculate offset to center the head optimally
+        offset_x = target_head_center[0] - (face_center[0] * scale)
+        offset_y = target_head_center[1] - (face_center[1] * scale)
+        
+        # Calculate the crop area from the scaled and positioned image
+        crop_left = max(0, -offset_x)
+        crop_top = max(0, -offset_y)
+        crop_right = min(scaled_img_width, crop_left + target_width)
+        crop_bottom = min(scaled_img_height, crop_top + target_height)
+        
+        # Convert back to original image coordinates
+        rect_left = crop_left / scale
+        rect_top = crop_top / scale
+        rect_right = crop_right / scale
+        rect_bottom = crop_bottom / scale
+        
+        # Ensure rectangle stays within image bounds
+        rect_left = max(0, min(image_width - target_width/scale, rect_left))
+        rect_top = max(0, min(image_height - target_height/scale, rect_top))
+        rect_right = min(image_width, rect_left + target_width/scale)
+        rect_bottom = min(image_height, rect_top + target_height/scale)
+        
+        return {
+            'x': int(rect_left * output_scale),
+            'y': int(rect_top * output_scale),
+            'width': int((rect_right - rect_left) * output_scale),
+            'height': int((rect_bottom - rect_top) * output_scale)
+        }
+    
     def _calculate_finnish_positioning(self, face_bbox, image_size, target_size, detection_method='opencv_haar'):
         """Calculate positioning specifically for Finnish passport requirements"""
         x1, y1, x2, y2 = face_bbox
@@ -471,172 +645,330 @@ class PassportPhotoProcessor:
     
     def create_passport_photo(self, image_bytes, country_specs):
         """Process image to create passport photo with proper head centering and scaling"""
+        return self.create_passport_photos(image_bytes, [country_specs])[0]
+    
+    def create_passport_photos(self, image_bytes, country_specs_list):
+        """Create passport photos for several countries; background removal and face detection run once"""
         try:
-            # Load and preprocess image
-            image = Image.open(io.BytesIO(image_bytes))
-            
-            # Handle EXIF orientation (important for camera photos)
-            image = ImageOps.exif_transpose(image)
-            
-            # Handle large images - resize if too big for performance
-            max_dimension = 3000  # Max width or height
-            if max(image.size) > max_dimension:
-                ratio = max_dimension / max(image.size)
-                new_size = (int(image.size[0] * ratio), int(image.size[1] * ratio))
-                image = image.resize(new_size, Image.Resampling.LANCZOS)
-                print(f"📏 Resized large image to {new_size[0]}×{new_size[1]} for processing")
-            
-            # Convert to RGB if needed (handle various formats)
-            if image.mode in ('RGBA', 'LA'):
-                # Create white background for transparent images
-                rgb_image = Image.new('RGB', image.size, (255, 255, 255))
-                if image.mode == 'RGBA':
-                    rgb_image.paste(image, mask=image.split()[3])
-                else:  # LA mode
-                    rgb_image.paste(image, mask=image.split()[1])
-                image = rgb_image
-            elif image.mode != 'RGB':
-                image = image.convert('RGB')
-            
-            # Convert back to bytes for background removal
-            processed_bytes = io.BytesIO()
-            image.save(processed_bytes, format='JPEG', quality=95)
-            processed_bytes.seek(0)
-            
-            # Remove background
-            no_bg_bytes = self.remove_background(processed_bytes.getvalue())
-            no_bg_image = Image.open(io.BytesIO(no_bg_bytes))
-            
-            # Detect face on the background-removed image (properly oriented)
-            faces = self.detect_face(no_bg_image)
-            
-            if not faces:
-                raise Exception("No face detected in the image")
-            
-            if len(faces) > 1:
-                raise Exception("Multiple faces detected. Please upload a photo with only one person.")
-            
-            # Get the most confident face
-            face = max(faces, key=lambda x: x['confidence'])
-            face_bbox = face['bbox']
-            detection_method = face.get('method', 'opencv_haar')
-            
-            # Calculate target dimensions
-            target_width = country_specs['photo_width']
-            target_height = country_specs['photo_height']
-            face_height_ratio = country_specs['face_height_ratio']
-            country_code = country_specs.get('country_code')
-            
-            # Calculate optimal scaling and positioning
-            image_size = (no_bg_image.width, no_bg_image.height)
-            target_size = (target_width, target_height)
-            
-            optimization = self.calculate_optimal_scale_and_position(
-                face_bbox, image_size, target_size, face_height_ratio, country_code, detection_method
+            # Decode once; every stage below works on in-memory images
+            image = self.load_image(image_bytes)
+            self._report('decoded')
+            
+            # Reject hopeless uploads before paying for background removal
+            self.preflight_check(image)
+            
+            # Face-first only keeps one country's crop region, so several countries share a whole-frame analysis
+            analysis = self.analyze_photo(
+                image,
+                country_specs_list[0] if len(country_specs_list) == 1 else None,
+                source=source_digest(image_bytes),
             )
-            
-            scale = optimization['scale']
-            target_head_center_x, target_head_center_y = optimization['target_head_center']
-            face_center_x, face_center_y = optimization['face_center']
-            
-            # Get original image dimensions
-            orig_width = no_bg_image.width
-            orig_height = no_bg_image.height
-            
-            # Calculate scaled dimensions maintaining aspect ratio
-            scaled_width = int(orig_width * scale)
-            scaled_height = int(orig_height * scale)
-            
-            # Calculate where the face center will be after scaling
-            scaled_face_center_x = face_center_x * scale
-            scaled_face_center_y = face_center_y * scale
-            
-            # Create working image by resizing with proper scaling
-            working_image = no_bg_image.resize((scaled_width, scaled_height), Image.Resampling.LANCZOS)
-            
-            # Recalculate scaled face center after resizing
-            scaled_face_center_x = face_center_x * scale
-            scaled_face_center_y = face_center_y * scale
-            
-            # Calculate where to position the image so the head is centered
-            paste_x = int(target_head_center_x - scaled_face_center_x)
-            paste_y = int(target_head_center_y - scaled_face_center_y)
-            
-            # Create final canvas
-            final_image = Image.new('RGB', (target_width, target_height), 'white')
-            
-            # Smart cropping and positioning for perfect head centering
-            if working_image.width <= target_width and working_image.height <= target_height:
-                # Image fits entirely - simple paste
-                if working_image.mode == 'RGBA':
-                    final_image.paste(working_image, (paste_x, paste_y), mask=working_image.split()[3])
-                else:
-                    final_image.paste(working_image, (paste_x, paste_y))
-            else:
-                # Image is larger than canvas - need to crop intelligently
-                # Calculate which part of the working image to use
-                source_left = 0
-                source_top = 0
-                source_right = working_image.width
-                source_bottom = working_image.height
-                
-                dest_left = paste_x
-                dest_top = paste_y
-                dest_right = paste_x + working_image.width
-                dest_bottom = paste_y + working_image.height
-                
-                # Adjust source and destination if image extends beyond canvas
-                if dest_left < 0:
-                    source_left = -dest_left
-                    dest_left = 0
-                if dest_top < 0:
-                    source_top = -dest_top
-                    dest_top = 0
-                if dest_right > target_width:
-                    source_right = working_image.width - (dest_right - target_width)
-                    dest_right = target_width
-                if dest_bottom > target_height:
-                    source_bottom = working_image.height - (dest_bottom - target_height)
-                    dest_bottom = target_height
-                
-                # Crop the working image to fit the destination area
-                if source_right > source_left and source_bottom > source_top:
-                    cropped_image = working_image.crop((source_left, source_top, source_right, source_bottom))
-                    
-                    # Paste the cropped image
-                    if cropped_image.mode == 'RGBA':
-                        final_image.paste(cropped_image, (dest_left, dest_top), mask=cropped_image.split()[3])
-                    else:
-                        final_image.paste(cropped_image, (dest_left, dest_top))
-            
-            # Enhance image quality
-            enhancer = ImageEnhance.Sharpness(final_image)
-            final_image = enhancer.enhance(1.1)
-            
-            # Slight contrast enhancement for better photo quality
-            contrast_enhancer = ImageEnhance.Contrast(final_image)
-            final_image = contrast_enhancer.enhance(1.05)
-            
-            # Finnish-specific output requirements
-            if country_code == 'FI':
-                return self._create_finnish_output(final_image)
-            
-            # Convert to bytes for other countries
-            output = io.BytesIO()
-            final_image.save(
-                output,
-                format='JPEG',
-                quality=settings.PASSPORT_PHOTO_SETTINGS['OUTPUT_QUALITY'],
-                dpi=(settings.PASSPORT_PHOTO_SETTINGS['OUTPUT_DPI'], 
-                     settings.PASSPORT_PHOTO_SETTINGS['OUTPUT_DPI'])
-            )
-            output.seek(0)
-            
-            return output.getvalue()
+            outputs = [self.render_passport_photo(analysis, country_specs) for country_specs in country_specs_list]
+            self._report('rendered')
+            return outputs
             
         except Exception as e:
             raise Exception(f"Photo processing failed: {str(e)}")
     
+    def analyze_photo(self, image, country_specs=None, source=None):
+        """Remove the background and locate the face; the result is what render_passport_photo needs
+
+        source is the upload's source_digest, which lets background removal use the mask cache.
+        """
+        pipeline_mode = settings.PASSPORT_PHOTO_SETTINGS.get('PIPELINE_MODE', 'sequential')
+        if pipeline_mode == 'face_first' and country_specs:
+            return self._analyze_face_first(image, country_specs, source)
+        if pipeline_mode == 'concurrent':
+            return self._analyze_concurrent(image, source)
+        return self._analyze_sequential(image, source)
+    
+    def _analyze_sequential(self, image, source=None):
+        """Remove the background from the whole frame, then detect the face on the result"""
+        # Remove background: predict the alpha mask and attach it to the decoded image
+        mask = self.remove_background_mask(image, source)
+        no_bg_image = self.apply_alpha_mask(image, mask)
+        self._report('background_removed')
+        
+        # Detect face on the background-removed image (properly oriented)
+        face = self.select_single_face(self.detect_face(no_bg_image))
+        self._report('face_detected')
+        
+        return {
+            'image': no_bg_image,
+            'face': face,
+            'offset': (0, 0),
+            'source_size': image.size,
+            'pipeline': 'sequential',
+            'matting': self.last_matting_path,
+        }
+    
+    def _analyze_concurrent(self, image, source=None):
+        """Detect the face on the original image while the background model runs"""
+        detection = get_stage_pool().submit(self.detect_face, image)
+        
+        # Background removal runs on this thread; latency is the slower of the two stages
+        mask = self.remove_background_mask(image, source)
+        no_bg_image = self.apply_alpha_mask(image, mask)
+        self._report('background_removed')
+        
+        face = self.select_single_face(detection.result())
+        self._report('face_detected')
+        
+        return {
+            'image': no_bg_image,
+            'face': face,
+            'offset': (0, 0),
+            'source_size': image.size,
+            'pipeline': 'concurrent',
+            'matting': self.last_matting_path,
+        }
+    
+    def _analyze_face_first(self, image, country_specs, source=None):
+        """Detect the face first, then remove the background only from the region that will be kept"""
+        face = self.select_single_face(self.detect_face(image))
+        self._report('face_detected')
+        
+        margin = settings.PASSPORT_PHOTO_SETTINGS.get('ROI_MARGIN', 0.1)
+        left, top, right, bottom = self.calculate_crop_region(face, image.size, country_specs, margin)
+        
+        region = image.crop((left, top, right, bottom))
+        mask = self.remove_background_mask(region, source, crop=((left, top, right, bottom), image.size))
+        no_bg_region = self.apply_alpha_mask(region, mask)
+        self._report('background_removed')
+        
+        roi_ratio = (region.width * region.height) / float(image.width * image.height)
+        print(f"✂️ Face-first ROI {region.width}×{region.height} ({roi_ratio:.0%} of frame)")
+        
+        return {
+            'image': no_bg_region,
+            'face': face,
+            'offset': (left, top),
+            'source_size': image.size,
+            'pipeline': 'face_first',
+            'matting': self.last_matting_path,
+        }
+    
+    def preflight_check(self, image):
+        """Cheap checks (face count, blur, exposure) that reject unusable photos before background removal"""
+        preflight = settings.PASSPORT_PHOTO_SETTINGS.get('PREFLIGHT', {})
+        if not preflight.get('ENABLED', False):
+            return None
+        
+        started = time.monotonic()
+        small, _ = make_proxy(image, preflight.get('MAX_DIMENSION', 640))
+        gray = cv2.cvtColor(np.asarray(small), cv2.COLOR_RGB2GRAY)
+        
+        # Variance of the Laplacian: low values mean few edges, i.e. an out-of-focus or shaken photo
+        sharpness = float(cv2.Laplacian(gray, cv2.CV_64F).var())
+        brightness = float(gray.mean())
+        
+        # Face count from a single small-size YOLO pass; only confident boxes count towards "multiple"
+        face_count = 0
+        if self.yolo_face_model:
+            sizes = settings.PASSPORT_PHOTO_SETTINGS.get('YOLO_INFERENCE_SIZES') or [None]
+            xyxy, conf = self._predict_yolo(np.asarray(small), sizes[0])
+            xyxy, conf = filter_face_boxes(
+                xyxy, conf, small.size, preflight.get('MULTI_FACE_CONFIDENCE', 0.6),
+                aspect_range=(0.5, 2.0),
+                area_range=(0.005, 0.8),
+            )
+            face_count = len(conf)
+        
+        # Nothing confident from YOLO (or no YOLO model): ask the Haar cascade before giving up. Not
+        # detect_face, which would repeat the pass above and count pre-flight in the detection metrics
+        if face_count == 0:
+            face_count = len(self._detect_face_opencv(small))
+        
+        report = {
+            'face_count': face_count,
+            'sharpness': round(sharpness, 1),
+            'brightness': round(brightness, 1),
+            'seconds': round(time.monotonic() - started, 3),
+        }
+        print(f"🛫 Pre-flight: {report}")
+        
+        if face_count == 0:
+            raise Exception("No face detected in the image")
+        if face_count > 1:
+            raise Exception("Multiple faces detected. Please upload a photo with only one person.")
+        if sharpness < preflight.get('MIN_SHARPNESS', 15.0):
+            raise Exception("Photo is too blurry. Please upload a sharper photo.")
+        if brightness < preflight.get('MIN_BRIGHTNESS', 30.0):
+            raise Exception("Photo is too dark. Please upload a better lit photo.")
+        if brightness > preflight.get('MAX_BRIGHTNESS', 240.0):
+            raise Exception("Photo is overexposed. Please upload a photo with less light.")
+        
+        return report
+    
+    def select_single_face(self, faces):
+        """Return the single usable face, or raise the user-facing error"""
+        if not faces:
+            raise Exception("No face detected in the image")
+        
+        if len(faces) > 1:
+            raise Exception("Multiple faces detected. Please upload a photo with only one person.")
+        
+        # Get the most confident face
+        return max(faces, key=lambda x: x['confidence'])
+    
+    def calculate_crop_region(self, face, image_size, country_specs, margin=0.0):
+        """Source-image rectangle (left, top, right, bottom) that lands on the output canvas"""
+        optimization = self.calculate_optimal_scale_and_position(
+            face['bbox'], image_size,
+            (country_specs['photo_width'], country_specs['photo_height']),
+            country_specs['face_height_ratio'],
+            country_specs.get('country_code'),
+            face.get('method', 'opencv_haar')
+        )
+        scale = optimization['scale']
+        target_head_center_x, target_head_center_y = optimization['target_head_center']
+        face_center_x, face_center_y = optimization['face_center']
+        
+        # Canvas pixel (x, y) shows source pixel ((x - paste_x) / scale, (y - paste_y) / scale)
+        paste_x = target_head_center_x - face_center_x * scale
+        paste_y = target_head_center_y - face_center_y * scale
+        left = -paste_x / scale
+        top = -paste_y / scale
+        right = (country_specs['photo_width'] - paste_x) / scale
+        bottom = (country_specs['photo_height'] - paste_y) / scale
+        
+        # Margin gives the background model some context around the kept area
+        margin_x = (right - left) * margin
+        margin_y = (bottom - top) * margin
+        
+        img_width, img_height = image_size
+        return (
+            max(0, int(np.floor(left - margin_x))),
+            max(0, int(np.floor(top - margin_y))),
+            min(img_width, int(np.ceil(right + margin_x))),
+            min(img_height, int(np.ceil(bottom + margin_y))),
+        )
+    
+    def render_passport_photo(self, analysis, country_specs):
+        """Scale, position, composite and encode the analysed photo for one country"""
+        no_bg_image = analysis['image']
+        face = analysis['face']
+        face_bbox = face['bbox']
+        detection_method = face.get('method', 'opencv_haar')
+        offset_x, offset_y = analysis['offset']
+        
+        # Calculate target dimensions
+        target_width = country_specs['photo_width']
+        target_height = country_specs['photo_height']
+        face_height_ratio = country_specs['face_height_ratio']
+        country_code = country_specs.get('country_code')
+        
+        # Calculate optimal scaling and positioning against the full source frame
+        image_size = analysis['source_size']
+        target_size = (target_width, target_height)
+        
+        optimization = self.calculate_optimal_scale_and_position(
+            face_bbox, image_size, target_size, face_height_ratio, country_code, detection_method
+        )
+        
+        scale = optimization['scale']
+        target_head_center_x, target_head_center_y = optimization['target_head_center']
+        face_center_x, face_center_y = optimization['face_center']
+        
+        # Face center relative to the analysed image, which may be a region of the source frame
+        face_center_x -= offset_x
+        face_center_y -= offset_y
+        
+        # Get original image dimensions
+        orig_width = no_bg_image.width
+        orig_height = no_bg_image.height
+        
+        # Calculate scaled dimensions maintaining aspect ratio
+        scaled_width = int(orig_width * scale)
+        scaled_height = int(orig_height * scale)
+        
+        # Calculate where the face center will be after scaling
+        scaled_face_center_x = face_center_x * scale
+        scaled_face_center_y = face_center_y * scale
+        
+        # Create working image by resizing with proper scaling
+        working_image = no_bg_image.resize((scaled_width, scaled_height), Image.Resampling.LANCZOS)
+        
+        # Recalculate scaled face center after resizing
+        scaled_face_center_x = face_center_x * scale
+        scaled_face_center_y = face_center_y * scale
+        
+        # Calculate where to position the image so the head is centered
+        paste_x = int(target_head_center_x - scaled_face_center_x)
+        paste_y = int(target_head_center_y - scaled_face_center_y)
+        
+        # Create final canvas
+        final_image = Image.new('RGB', (target_width, target_height), 'white')
+        
+        # Smart cropping and positioning for perfect head centering
+        if working_image.width <= target_width and working_image.height <= target_height:
+            # Image fits entirely - simple paste
+            if working_image.mode == 'RGBA':
+                final_image.paste(working_image, (paste_x, paste_y), mask=working_image.split()[3])
+            else:
+                final_image.paste(working_image, (paste_x, paste_y))
+        else:
+            # Image is larger than canvas - need to crop intelligently
+            # Calculate which part of the working image to use
+            source_left = 0
+            source_top = 0
+            source_right = working_image.width
+            source_bottom = working_image.height
+            
+            dest_left = paste_x
+            dest_top = paste_y
+            dest_right = paste_x + working_image.width
+            dest_bottom = paste_y + working_image.height
+            
+            # Adjust source and destination if image extends beyond canvas
+            if dest_left < 0:
+                source_left = -dest_left
+                dest_left = 0
+            if dest_top < 0:
+                source_top = -dest_top
+                dest_top = 0
+            if dest_right > target_width:
+                source_right = working_image.width - (dest_right - target_width)
+                dest_right = target_width
+            if dest_bottom > target_height:
+                source_bottom = working_image.height - (dest_bottom - target_height)
+                dest_bottom = target_height
+            
+            # Crop the working image to fit the destination area
+            if source_right > source_left and source_bottom > source_top:
+                cropped_image = working_image.crop((source_left, source_top, source_right, source_bottom))
+                
+                # Paste the cropped image
+                if cropped_image.mode == 'RGBA':
+                    final_image.paste(cropped_image, (dest_left, dest_top), mask=cropped_image.split()[3])
+                else:
+                    final_image.paste(cropped_image, (dest_left, dest_top))
+        
+        # Enhance image quality
+        enhancer = ImageEnhance.Sharpness(final_image)
+        final_image = enhancer.enhance(1.1)
+        
+        # Slight contrast enhancement for better photo quality
+        contrast_enhancer = ImageEnhance.Contrast(final_image)
+        final_image = contrast_enhancer.enhance(1.05)
+        
+        # Finnish-specific output requirements
+        if country_code == 'FI':
+            return self._create_finnish_output(final_image)
+        
+        # Convert to bytes for other countries
+        output = io.BytesIO()
+        final_image.save(
+            output,
+            format='JPEG',
+            quality=settings.PASSPORT_PHOTO_SETTINGS['OUTPUT_QUALITY'],
+            dpi=(settings.PASSPORT_PHOTO_SETTINGS['OUTPUT_DPI'], 
+                 settings.PASSPORT_PHOTO_SETTINGS['OUTPUT_DPI'])
+        )
+        output.seek(0)
+        
+        return output.getvalue()
+
     def _create_finnish_output(self, image):
         """Create output specifically for Finnish passport requirements"""
         # Finnish requirements: exactly 500x653 pixels, max 250KB
@@ -4,7 +4,10 @@ from . import views
 urlpatterns = [
     path('countries/', views.CountryListView.as_view(), name='countries-list'),
     path('upload/', views.upload_photo, name='upload-photo'),
+    path('upload/multi/', views.upload_photo_multi, name='upload-photo-multi'),
     path('job/<uuid:job_id>/', views.job_status, name='job-status'),
+    path('analyze/', views.analyze_photo, name='analyze-photo'),
     path('prepare/', views.prepare_photo, name='prepare-photo'),
+    path('prepared/<str:token>/image.<str:extension>', views.prepared_image, name='prepared-image'),
     path('generate/', views.generate_photo, name='generate-photo'),
 ]
\ No newline at end of file
@@ -3,19 +3,98 @@ from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from django.core.files.base import ContentFile
 from django.utils import timezone
-from .models import Country, PhotoProcessingJob
-from .serializers import CountrySerializer, PhotoUploadSerializer, PhotoProcessingJobSerializer
+from .models import Country, PhotoProcessingJob, PhotoOutput
+from .serializers import (
+    CountrySerializer, PhotoUploadSerializer, PhotoAnalysisSerializer, MultiCountryUploadSerializer,
+    PhotoProcessingJobSerializer,
+)
 from .services import PassportPhotoProcessor
-import threading
+from .model_registry import get_model_registry, start_warm_up
+from .job_queue import enqueue_job, country_specs, queue_position, uses_database_queue
+from .progress import get_progress_broadcaster
+from .country_cache import get_country_cache
+from .matting import proxy_size
+from .prepared_sessions import get_prepared_store, analyze_session, session_image
+from .job_executor import get_job_executor
+from django.conf import settings
+from django.db import transaction
+from django.db.models import prefetch_related_objects
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.views.decorators.http import require_GET
 import uuid
 import base64
+import hashlib
 import json
+import time
 from PIL import Image
 import io
 
+# Encodings a prepared image can be served in: extension -> (Pillow format, content type, save options)
+PREPARED_IMAGE_FORMATS = {
+    'webp': ('WEBP', 'image/webp', {'quality': 90, 'method': 4}),
+    'png': ('PNG', 'image/png', {'compress_level': 1}),
+}
+
+# Retry-After of a request that needs an analysis still running in a worker
+ANALYSIS_RETRY_AFTER_SECONDS = 1
+
+def _conditional_response(request, build_response, etag, last_modified, cache_control):
+    """304 if the client's copy is still current, otherwise build_response(); both carry the validators"""
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is None:
+        response = build_response()
+    response['ETag'] = etag
+    if timestamp is not None:
+        response['Last-Modified'] = http_date(timestamp)
+    response['Cache-Control'] = cache_control
+    return response
+
 class CountryListView(generics.ListAPIView):
     queryset = Country.objects.all().order_by('name')
     serializer_class = CountrySerializer
+    
+    def list(self, request, *args, **kwargs):
+        # Served from the in-process cache; the list is public, so shared caches may keep it too
+        data, etag, last_modified = get_country_cache().get()
+        max_age = settings.PASSPORT_PHOTO_SETTINGS.get('COUNTRY_LIST', {}).get('MAX_AGE_SECONDS', 300)
+        return _conditional_response(
+            request, lambda: Response(data), etag, last_modified, f'public, max-age={max_age}',
+        )
+
+def _parse_country_ids(data):
+    """Optional country_ids form field: repeated values or one comma-separated string"""
+    values = data.getlist('country_ids') if hasattr(data, 'getlist') else data.get('country_ids') or []
+    if isinstance(values, (str, int)):
+        values = [values]
+    country_ids = []
+    for value in values:
+        for part in str(value).split(','):
+            if part.strip():
+                country_ids.append(int(part))
+    return country_ids
+
+@api_view(['GET'])
+def health_check(request):
+    """Readiness probe: not ready until the inference models have been warmed up"""
+    registry = get_model_registry()
+    warm_up_enabled = settings.PASSPORT_PHOTO_SETTINGS.get('WARM_UP_ON_STARTUP', False)
+    if warm_up_enabled and not registry.ready:
+        # Covers servers that never import wsgi.py, and retries a warm-up that failed
+        start_warm_up()
+    models_status = registry.status()
+    # In-process jobs of this web process; with the database queue the workers run them instead
+    jobs_status = None if uses_database_queue() else get_job_executor().stats()
+    
+    if registry.ready or not warm_up_enabled:
+        return Response({'status': 'ready', 'models': models_status, 'jobs': jobs_status})
+    
+    # A failed warm-up is retried in the background; 'degraded' tells it apart from one still starting
+    health = 'degraded' if registry.warm_up_failed else 'not_ready'
+    return Response({'status': health, 'models': models_status, 'jobs': jobs_status}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
 
 @api_view(['POST'])
 def upload_photo(request):
@@ -26,14 +105,16 @@ def upload_photo(request):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
     try:
-        photo = serializer.validated_data['photo']
-        country_id = serializer.validated_data['country_id']
+        country = serializer.validated_data['country']
         
-        # Get country
-        country = Country.objects.get(id=country_id)
+        # With an analysis_id the expensive stages run (or already ran) in the analysis job
+        if serializer.validated_data.get('analysis_id'):
+            return _queue_analysed_upload(serializer.validated_data['analysis_id'], country)
         
-        # Validate image
         processor = PassportPhotoProcessor()
+        
+        # Validate image
+        photo = serializer.validated_data['photo']
         processor.validate_image(photo)
         
         # Create processing job
@@ -43,184 +124,389 @@ def upload_photo(request):
             status='pending'
         )
         
-        # Start background processing
-        thread = threading.Thread(
-            target=process_photo_background,
-            args=(job.id,)
-        )
-        thread.daemon = True
-        thread.start()
+        # Queue background processing (in-process executor or durable DB queue)
+        queue_position = enqueue_job(job)
         
         # Return job ID for tracking
         return Response({
             'job_id': job.id,
             'status': 'pending',
+            'queue_position': queue_position,
+            'message': 'Photo uploaded successfully. Processing started.'
+        }, status=status.HTTP_201_CREATED)
+        
+    except Exception as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+def _queue_analysed_upload(analysis_id, country):
+    """Queue a render job that reuses a speculative analysis; the worker does the positioning and encoding"""
+    analysis = _analysis_job(analysis_id)
+    if analysis is None:
+        return _analysis_error(None)
+    if analysis.status == 'failed':
+        return _analysis_error({'state': 'failed', 'error': analysis.error_message})
+    
+    # Same stored upload as the analysis, so the worker can fall back to the full pipeline
+    job = PhotoProcessingJob.objects.create(
+        country=country,
+        original_photo=analysis.original_photo.name,
+        analysis=analysis,
+        status='pending'
+    )
+    
+    # A render never holds a worker while its analysis runs: the database queue defers it, and the
+    # in-process executor gets it from the analysis job once that finishes (release_renders). The
+    # status is re-read after the row exists, so an analysis finishing in between can't miss it.
+    analysis.refresh_from_db(fields=['status'])
+    if uses_database_queue() or analysis.status in ('completed', 'failed'):
+        position = enqueue_job(job)
+    else:
+        position = queue_position(job)
+    
+    return Response({
+        'job_id': job.id,
+        'status': 'pending',
+        'queue_position': position,
+        'message': 'Photo uploaded successfully. Processing started.'
+    }, status=status.HTTP_201_CREATED)
+
+@api_view(['POST'])
+def upload_photo_multi(request):
+    """Upload one photo and process it for several countries in a single job"""
+    serializer = MultiCountryUploadSerializer(data=request.data)
+    
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        photo = serializer.validated_data['photo']
+        countries = serializer.validated_data['country_ids']
+        
+        # Validate image
+        processor = PassportPhotoProcessor()
+        processor.validate_image(photo)
+        
+        # The first country is the job's primary one; every country gets its own output
+        with transaction.atomic():
+            job = PhotoProcessingJob.objects.create(
+                country=countries[0],
+                original_photo=photo,
+                status='pending'
+            )
+            PhotoOutput.objects.bulk_create([PhotoOutput(job=job, country=country) for country in countries])
+        
+        # Queue background processing (in-process executor or durable DB queue)
+        queue_position = enqueue_job(job)
+        
+        return Response({
+            'job_id': job.id,
+            'status': 'pending',
+            'queue_position': queue_position,
+            'countries': [country.code for country in countries],
             'message': 'Photo uploaded successfully. Processing started.'
         }, status=status.HTTP_201_CREATED)
         
-    except Country.DoesNotExist:
-        return Response({'error': 'Country not found'}, status=status.HTTP_404_NOT_FOUND)
     except Exception as e:
         return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
+def _job_etag(request, job, position):
+    # Everything in the payload follows from these fields (the URLs also from the host), so
+    # unchanged jobs are answered without serializing them; stage changes move updated_at
+    fingerprint = f'{job.id}|{job.updated_at.isoformat()}|{job.status}|{position}|{request.build_absolute_uri("/")}'
+    return '"{}"'.format(hashlib.blake2b(fingerprint.encode(), digest_size=16).hexdigest())
+
+def _wait_seconds(request):
+    """Long-poll hold requested with ?wait=, capped by JOB_STATUS['MAX_WAIT_SECONDS']"""
+    try:
+        wait = float(request.query_params.get('wait', 0))
+    except ValueError:
+        return 0
+    max_wait = settings.PASSPORT_PHOTO_SETTINGS.get('JOB_STATUS', {}).get('MAX_WAIT_SECONDS', 0)
+    return min(max(wait, 0), max_wait)
+
+def _wait_for_job_change(job, wait_seconds):
+    """Hold a status request until the job row changes or wait_seconds pass; returns the current job
+
+    Jobs run in this process wake the request at once. Others (run_photo_workers) are re-read every
+    CHECK_INTERVAL_SECONDS with one primary-key query; the queue position, a COUNT, is only
+    recomputed once the hold ends.
+    """
+    check_interval = settings.PASSPORT_PHOTO_SETTINGS.get('JOB_STATUS', {}).get('CHECK_INTERVAL_SECONDS', 1.0)
+    broadcaster = get_progress_broadcaster()
+    version = broadcaster.watch(job.id)
+    try:
+        deadline = time.monotonic() + wait_seconds
+        seen = (job.updated_at, job.status)
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            version = broadcaster.wait(job.id, version, min(check_interval, remaining))
+            current = PhotoProcessingJob.objects.filter(id=job.id).values_list('updated_at', 'status').first()
+            if current != seen:
+                break
+    finally:
+        broadcaster.unwatch(job.id)
+    return PhotoProcessingJob.objects.select_related('country').get(id=job.id)
+
 @api_view(['GET'])
 def job_status(request, job_id):
-    """Get processing job status"""
+    """Get processing job status
+
+    Responses carry an ETag, so a poll with If-None-Match costs a 304 while nothing changed. Where
+    JOB_STATUS['MAX_WAIT_SECONDS'] enables it, ?wait=<seconds> also holds such a poll on an
+    unfinished job until the job changes (or the hold ends, answered 304).
+    """
     try:
-        job = PhotoProcessingJob.objects.get(id=job_id)
+        # The nested country is joined in; outputs are only fetched when the payload is actually built
+        job = PhotoProcessingJob.objects.select_related('country').get(id=job_id)
         
         # Check if job is expired
         if timezone.now() > job.expires_at:
             job.delete()
             return Response({'error': 'Job expired'}, status=status.HTTP_404_NOT_FOUND)
         
-        serializer = PhotoProcessingJobSerializer(job, context={'request': request})
-        return Response(serializer.data)
+        position = queue_position(job)
+        etag = _job_etag(request, job, position)
+        
+        # Only a client that is already up to date is held, and only while the job can still change
+        wait_seconds = _wait_seconds(request)
+        if wait_seconds and job.status in ('pending', 'processing') and request.headers.get('If-None-Match') == etag:
+            job = _wait_for_job_change(job, wait_seconds)
+            position = queue_position(job)
+            etag = _job_etag(request, job, position)
+        
+        # Pending jobs change queue position without being saved, so only settled jobs get Last-Modified
+        last_modified = job.updated_at if job.status in ('completed', 'failed') else None
+        
+        def build_response():
+            prefetch_related_objects([job], 'outputs__country')
+            serializer = PhotoProcessingJobSerializer(job, context={'request': request, 'queue_position': position})
+            return Response(serializer.data)
+        
+        return _conditional_response(request, build_response, etag, last_modified, 'private, no-cache')
         
     except PhotoProcessingJob.DoesNotExist:
         return Response({'error': 'Job not found'}, status=status.HTTP_404_NOT_FOUND)
 
+def _analysis_job(analysis_id):
+    """The analysis job behind an analysis_id, or None if it is unknown or expired"""
+    try:
+        analysis_id = uuid.UUID(str(analysis_id))
+    except ValueError:
+        return None
+    return PhotoProcessingJob.objects.filter(id=analysis_id, kind='analysis', expires_at__gt=timezone.now()).first()
+
+def _prepared_session(validated_data, processor):
+    """(token, metadata) of the analysed session for a request carrying a photo or an analysis_id"""
+    token = validated_data.get('analysis_id')
+    if token:
+        return token, _analysis_state(token)
+    
+    photo = validated_data['photo']
+    processor.validate_image(photo)
+    photo.seek(0)
+    token = get_prepared_store().create(photo.read())
+    return token, analyze_session(token, processor)
+
+def _analysis_state(token):
+    """Session metadata of an analysis, without waiting for one that is still running
+
+    A session stays 'analyzing' if its job gave up (e.g. after too many interrupted attempts), so
+    the job row has the last word on failures.
+    """
+    metadata = get_prepared_store().metadata(token)
+    if metadata is not None and metadata['state'] == 'analyzing':
+        analysis = _analysis_job(token)
+        if analysis is not None and analysis.status == 'failed':
+            return {'state': 'failed', 'error': analysis.error_message}
+    return metadata
+
+def _analysis_error(metadata):
+    """Error response for a session whose analysis is unusable, or None"""
+    if metadata is None:
+        return Response({'error': 'Photo analysis has expired. Please upload the photo again.'}, status=status.HTTP_410_GONE)
+    if metadata['state'] == 'failed':
+        return Response({'error': metadata['error']}, status=status.HTTP_400_BAD_REQUEST)
+    if metadata['state'] == 'analyzing':
+        # Clients retry rather than a request thread waiting for the worker
+        return Response(
+            {'error': 'Photo analysis is still running. Please try again.'},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers={'Retry-After': str(ANALYSIS_RETRY_AFTER_SECONDS)},
+        )
+    return None
+
 @api_view(['POST'])
-def prepare_photo(request):
-    """Upload photo, remove background, and detect face for manual selection"""
-    serializer = PhotoUploadSerializer(data=request.data)
+def analyze_photo(request):
+    """Start background removal and face detection before the country is known"""
+    serializer = PhotoAnalysisSerializer(data=request.data)
     
     if not serializer.is_valid():
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
     try:
         photo = serializer.validated_data['photo']
-        country_id = serializer.validated_data['country_id']
-        
-        # Get country
-        country = Country.objects.get(id=country_id)
         
         # Validate image
         processor = PassportPhotoProcessor()
         processor.validate_image(photo)
         
-        # Read photo bytes
-        photo.seek(0)
-        image_bytes = photo.read()
-        
-        # Remove background
-        no_bg_bytes = processor.remove_background(image_bytes)
-        no_bg_image = Image.open(io.BytesIO(no_bg_bytes))
-        
-        # Detect face
-        faces = processor.detect_face(no_bg_image)
-        
-        if not faces:
-            return Response({'error': 'No face detected in the image'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        if len(faces) > 1:
-            return Response({'error': 'Multiple faces detected. Please upload a photo with only one person.'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        # Get the best face
-        face = max(faces, key=lambda x: x['confidence'])
-        face_bbox = face['bbox']
-        
-        # Convert background-removed image to base64
-        bg_removed_buffer = io.BytesIO()
-        if no_bg_image.mode == 'RGBA':
-            no_bg_image.save(bg_removed_buffer, format='PNG')
-        else:
-            no_bg_image.save(bg_removed_buffer, format='JPEG', quality=85)
-        bg_removed_buffer.seek(0)
-        
-        bg_removed_base64 = base64.b64encode(bg_removed_buffer.getvalue()).decode('utf-8')
-        
-        # Use the same logic as automatic mode for default rectangle
-        target_width = country.photo_width
-        target_height = country.photo_height
-        face_height_ratio = country.face_height_ratio
-        image_width = no_bg_image.width
-        image_height = no_bg_image.height
-        
-        # Get detection method for proper positioning
-        detection_method = face['method']
-        
-        # Use the same calculation as automatic mode
-        positioning_data = processor.calculate_optimal_scale_and_position(
-            face_bbox, 
-            (image_width, image_height), 
-            (target_width, target_height), 
-            face_height_ratio,
-            country.code,
-            detection_method
+        # A job like any other, so it runs on the configured backend (run_photo_workers with the
+        # database queue) and shares its limits and retries; the ID doubles as the session token
+        job = PhotoProcessingJob.objects.create(
+            kind='analysis',
+            original_photo=photo,
+            status='pending'
         )
+        photo.seek(0)
+        get_prepared_store().create(photo.read(), str(job.id))
+        queue_position = enqueue_job(job)
         
-        scale = positioning_data['scale']
-        target_head_center = positioning_data['target_head_center']
-        face_center = positioning_data['face_center']
-        
-        # Calculate the cropping area that would be used in automatic mode
-        scaled_img_width = image_width * scale
-        scaled_img_height = image_height * scale
-        
-        # Calculate offset to center the head optimally
-        offset_x = target_head_center[0] - (face_center[0] * scale)
-        offset_y = target_head_center[1] - (face_center[1] * scale)
-        
-        # Calculate the crop area from the scaled and positioned image
-        crop_left = max(0, -offset_x)
-        crop_top = max(0, -offset_y)
-        crop_right = min(scaled_img_width, crop_left + target_width)
-        crop_bottom = min(scaled_img_height, crop_top + target_height)
+        return Response({
+            'analysis_id': str(job.id),
+            'status': 'analyzing',
+            'queue_position': queue_position,
+        }, status=status.HTTP_202_ACCEPTED)
         
-        # Convert back to original image coordinates
-        rect_left = crop_left / scale
-        rect_top = crop_top / scale
-        rect_right = crop_right / scale
-        rect_bottom = crop_bottom / scale
+    except Exception as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+@api_view(['POST'])
+def prepare_photo(request):
+    """Upload photo (or reference an analysis), remove background, and detect face for manual selection"""
+    serializer = PhotoUploadSerializer(data=request.data)
+    
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        country = serializer.validated_data['country']
         
-        # Ensure rectangle stays within image bounds
-        rect_left = max(0, min(image_width - target_width/scale, rect_left))
-        rect_top = max(0, min(image_height - target_height/scale, rect_top))
-        rect_right = min(image_width, rect_left + target_width/scale)
-        rect_bottom = min(image_height, rect_top + target_height/scale)
+        processor = PassportPhotoProcessor()
+        token, metadata = _prepared_session(serializer.validated_data, processor)
+        error_response = _analysis_error(metadata)
+        if error_response:
+            return error_response
+        
+        face = metadata['face']
+        image_size = (metadata['width'], metadata['height'])
+        
+        # The editor only gets a screen-sized preview; all geometry in the response is in preview pixels
+        preview_scale = metadata['preview_scale']
+        preview_dimensions, _ = proxy_size(image_size, settings.PASSPORT_PHOTO_SETTINGS.get('PREPARED_SESSIONS', {}).get('PREVIEW_MAX_DIMENSION'))
+        
+        # The image itself is served by prepared_image; the JSON only carries its URL and the geometry
+        image_extension = settings.PASSPORT_PHOTO_SETTINGS.get('PREPARED_SESSIONS', {}).get('IMAGE_FORMAT', 'webp')
+        image_url = request.build_absolute_uri(reverse('prepared-image', args=[token, image_extension]))
+        
+        # Default rectangles for every offered country (or the requested subset), so the editor can
+        # switch countries without another upload; the arithmetic is microseconds per country
+        requested_ids = _parse_country_ids(request.data)
+        countries = Country.objects.filter(id__in=requested_ids) if requested_ids else Country.objects.all()
+        countries = {c.id: c for c in countries.order_by('name')}
+        countries.setdefault(country.id, country)
+        
+        country_selections = [
+            {
+                'country': {
+                    'id': option.id,
+                    'name': option.name,
+                    'code': option.code
+                },
+                'target_dimensions': {
+                    'width': option.photo_width,
+                    'height': option.photo_height
+                },
+                'default_selection': processor.default_selection(
+                    face, image_size, country_specs(option), preview_scale
+                ),
+            }
+            for option in countries.values()
+        ]
+        selected = next(option for option in country_selections if option['country']['id'] == country.id)
         
         return Response({
-            'image_data': bg_removed_base64,
-            'image_format': 'PNG' if no_bg_image.mode == 'RGBA' else 'JPEG',
+            'token': token,
+            'analysis_id': token,
+            'image_url': image_url,
+            'image_format': PREPARED_IMAGE_FORMATS[image_extension][0],
             'image_dimensions': {
-                'width': image_width,
-                'height': image_height
+                'width': preview_dimensions[0],
+                'height': preview_dimensions[1]
             },
-            'face_bbox': face_bbox,
-            'default_selection': {
-                'x': int(rect_left),
-                'y': int(rect_top),
-                'width': int(rect_right - rect_left),
-                'height': int(rect_bottom - rect_top)
+            'source_dimensions': {
+                'width': metadata['width'],
+                'height': metadata['height']
             },
-            'target_dimensions': {
-                'width': target_width,
-                'height': target_height
+            'preview_scale': preview_scale,
+            'face_bbox': [int(round(value * preview_scale)) for value in face['bbox']],
+            'preflight': metadata['preflight'],
+            'matting': metadata['matting'],
+            'detection': {
+                'method': face['method'],
+                'confidence': face['confidence'],
+                'inference_size': face.get('inference_size'),
             },
-            'country': {
-                'id': country.id,
-                'name': country.name,
-                'code': country.code
-            }
+            'default_selection': selected['default_selection'],
+            'target_dimensions': selected['target_dimensions'],
+            'country': selected['country'],
+            'country_selections': country_selections,
         })
         
-    except Country.DoesNotExist:
-        return Response({'error': 'Country not found'}, status=status.HTTP_404_NOT_FOUND)
     except Exception as e:
         return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
+@require_GET
+def prepared_image(request, token, extension):
+    """Serve the preview of a prepared (background-removed) photo as a binary image; WebP with alpha or PNG"""
+    if extension not in PREPARED_IMAGE_FORMATS:
+        return JsonResponse({'error': 'Unsupported image format'}, status=status.HTTP_404_NOT_FOUND)
+    
+    # A token's image never changes, so the browser may keep it for the session's whole lifetime
+    etag = f'"{token}.{extension}"'
+    if request.headers.get('If-None-Match') == etag:
+        return HttpResponseNotModified()
+    
+    store = get_prepared_store()
+    name = f'image.{extension}'
+    data = store.read_rendition(token, name)
+    if data is None:
+        prepared = store.load(token)
+        if prepared is None:
+            return JsonResponse({'error': 'Prepared photo has expired. Please upload the photo again.'}, status=status.HTTP_410_GONE)
+        
+        source_bytes, mask, metadata = prepared
+        image = session_image(source_bytes, mask, PassportPhotoProcessor())
+        # Sized from the full resolution, exactly as prepare_photo reported the preview's dimensions
+        preview_max_dimension = settings.PASSPORT_PHOTO_SETTINGS.get('PREPARED_SESSIONS', {}).get('PREVIEW_MAX_DIMENSION')
+        preview_size, _ = proxy_size((metadata['width'], metadata['height']), preview_max_dimension)
+        if image.size != preview_size:
+            image = image.resize(preview_size, Image.Resampling.BILINEAR, reducing_gap=2.0)
+        
+        image_format, _, save_options = PREPARED_IMAGE_FORMATS[extension]
+        buffer = io.BytesIO()
+        image.save(buffer, format=image_format, **save_options)
+        data = buffer.getvalue()
+        store.write_rendition(token, name, data)
+    
+    response = HttpResponse(data, content_type=PREPARED_IMAGE_FORMATS[extension][1])
+    response['Cache-Control'] = f'private, max-age={store.ttl_seconds}, immutable'
+    response['ETag'] = etag
+    return response
+
 @api_view(['POST'])
 def generate_photo(request):
     """Generate final passport photo from selected area"""
     try:
-        # Get request data
+        # Get request data; the prepared photo is referenced by token (image_data is the legacy base64 upload)
+        token = request.data.get('token') or request.data.get('analysis_id')
         image_data = request.data.get('image_data')
         selection = request.data.get('selection')
         country_id = request.data.get('country_id')
         
-        if not all([image_data, selection, country_id]):
-            return Response({'error': 'Missing required fields: image_data, selection, country_id'}, status=status.HTTP_400_BAD_REQUEST)
+        if not all([token or image_data, selection, country_id]):
+            return Response({'error': 'Missing required fields: token, selection, country_id'}, status=status.HTTP_400_BAD_REQUEST)
         
         # Validate and get country
         try:
@@ -233,26 +519,43 @@ def generate_photo(request):
         except Country.DoesNotExist:
             return Response({'error': 'Country not found'}, status=status.HTTP_404_NOT_FOUND)
         
-        # Validate and decode base64 image
-        try:
-            # Validate base64 string length (prevent DoS attacks)
-            if len(image_data) > 50 * 1024 * 1024:  # 50MB limit for base64 string
-                return Response({'error': 'Image data too large'}, status=status.HTTP_400_BAD_REQUEST)
+        if token:
+            error_response = _analysis_error(_analysis_state(token))
+            if error_response:
+                return error_response
+            
+            prepared = get_prepared_store().load(token)
+            if prepared is None:
+                return Response({'error': 'Prepared photo has expired. Please upload the photo again.'}, status=status.HTTP_410_GONE)
+            
+            source_bytes, mask, metadata = prepared
+            image = session_image(source_bytes, mask, PassportPhotoProcessor(), full_resolution=True)
+            
+            # The editor worked on the preview; selections are mapped back to the full-resolution copy
+            preview_scale = metadata.get('preview_scale', 1.0)
+        else:
+            preview_scale = 1.0
+            
+            # Validate and decode base64 image (legacy clients)
+            try:
+                # Validate base64 string length (prevent DoS attacks)
+                if len(image_data) > 50 * 1024 * 1024:  # 50MB limit for base64 string
+                    return Response({'error': 'Image data too large'}, status=status.HTTP_400_BAD_REQUEST)
                 
-            image_bytes = base64.b64decode(image_data)
+                image_bytes = base64.b64decode(image_data)
             
-            # Validate decoded image size
-            if len(image_bytes) > 20 * 1024 * 1024:  # 20MB limit for decoded image
-                return Response({'error': 'Image file too large'}, status=status.HTTP_400_BAD_REQUEST)
+                # Validate decoded image size
+                if len(image_bytes) > 20 * 1024 * 1024:  # 20MB limit for decoded image
+                    return Response({'error': 'Image file too large'}, status=status.HTTP_400_BAD_REQUEST)
                 
-            image = Image.open(io.BytesIO(image_bytes))
+                image = Image.open(io.BytesIO(image_bytes))
             
-            # Validate image dimensions
-            if image.width > 10000 or image.height > 10000:
-                return Response({'error': 'Image dimensions too large'}, status=status.HTTP_400_BAD_REQUEST)
+                # Validate image dimensions
+                if image.width > 10000 or image.height > 10000:
+                    return Response({'error': 'Image dimensions too large'}, status=status.HTTP_400_BAD_REQUEST)
                 
-        except Exception as e:
-            return Response({'error': 'Invalid image data'}, status=status.HTTP_400_BAD_REQUEST)
+            except Exception as e:
+                return Response({'error': 'Invalid image data'}, status=status.HTTP_400_BAD_REQUEST)
         
         # Validate and extract selection coordinates
         try:
@@ -261,6 +564,13 @@ def generate_photo(request):
             sel_width = int(selection.get('width', 0))
             sel_height = int(selection.get('height', 0))
             
+            if preview_scale != 1.0:
+                sel_x = int(round(sel_x / preview_scale))
+                sel_y = int(round(sel_y / preview_scale))
+                # Rounding can push a selection that touches the preview's edge a pixel past the full-resolution one
+                sel_width = min(int(round(sel_width / preview_scale)), image.width - sel_x)
+                sel_height = min(int(round(sel_height / preview_scale)), image.height - sel_y)
+            
             # Validate selection bounds
             if sel_x < 0 or sel_y < 0 or sel_width <= 0 or sel_height <= 0:
                 return Response({'error': 'Invalid selection coordinates: values must be positive'}, status=status.HTTP_400_BAD_REQUEST)
@@ -359,48 +669,3 @@ def generate_photo(request):
         return Response({'error': 'Country not found'}, status=status.HTTP_404_NOT_FOUND)
     except Exception as e:
         return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
-
-def process_photo_background(job_id):
-    """Background task to process photo"""
-    try:
-        job = PhotoProcessingJob.objects.get(id=job_id)
-        job.status = 'processing'
-        job.save()
-        
-        # Get country specifications
-        country_specs = {
-            'photo_width': job.country.photo_width,
-            'photo_height': job.country.photo_height,
-            'face_height_ratio': job.country.face_height_ratio,
-            'country_code': job.country.code,
-        }
-        
-        # Process the photo
-        processor = PassportPhotoProcessor()
-        
-        # Read original photo
-        with job.original_photo.open('rb') as f:
-            image_bytes = f.read()
-        
-        # Create passport photo
-        processed_bytes = processor.create_passport_photo(image_bytes, country_specs)
-        
-        # Save processed photo
-        filename = f"passport_{job.id}.jpg"
-        job.processed_photo.save(
-            filename,
-            ContentFile(processed_bytes),
-            save=False
-        )
-        
-        job.status = 'completed'
-        job.save()
-        
-    except Exception as e:
-        try:
-            job = PhotoProcessingJob.objects.get(id=job_id)
-            job.status = 'failed'
-            job.error_message = str(e)
-            job.save()
-        except:
-            pass
\ No newline at end of file
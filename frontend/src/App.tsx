@@ -1,4 +1,4 @@
-import React, { useState, useEffect, useCallback } from 'react';
+import React, { useState, useEffect, useCallback, useRef } from 'react';
 import { useTranslation } from 'react-i18next';
 import { apiService } from './services/api';
 import { Country, PhotoProcessingJob, PrepareResponse, GenerateResponse } from './types';
@@ -8,6 +8,9 @@ import ProcessingStatus from './components/ProcessingStatus';
 import LanguageSwitch from './components/LanguageSwitch';
 import PhotoEditor from './components/PhotoEditor';
 
+// Minimum time between two job status polls
+const JOB_POLL_INTERVAL_MS = 2000;
+
 const App: React.FC = () => {
   const { t } = useTranslation();
   const [countries, setCountries] = useState<Country[]>([]);
@@ -20,6 +23,8 @@ const App: React.FC = () => {
   const [processingMode, setProcessingMode] = useState<'auto' | 'semi-auto'>('semi-auto');
   const [prepareData, setPrepareData] = useState<PrepareResponse | null>(null);
   const [isPreparingPhoto, setIsPreparingPhoto] = useState(false);
+  // Speculative analysis started as soon as a file is picked; resolves to null if it could not start
+  const analysisRef = useRef<Promise<string | null> | null>(null);
 
   const loadCountries = useCallback(async () => {
     try {
@@ -35,35 +40,56 @@ const App: React.FC = () => {
     loadCountries();
   }, [loadCountries]);
 
+  const activeJobId = currentJob && (currentJob.status === 'pending' || currentJob.status === 'processing')
+    ? currentJob.id
+    : null;
+
   useEffect(() => {
-    let interval: NodeJS.Timeout;
-    
-    if (currentJob && (currentJob.status === 'pending' || currentJob.status === 'processing')) {
+    if (!activeJobId) return;
+
+    let cancelled = false;
+
+    // Conditional polling: unchanged jobs cost a 304, and servers that allow it hold the request
+    // until the job changes, in which case the next poll starts right away
+    const poll = async () => {
       setIsPolling(true);
-      interval = setInterval(async () => {
+      let etag: string | null = null;
+      while (!cancelled) {
         try {
-          const updatedJob = await apiService.getJobStatus(currentJob.id);
-          setCurrentJob(updatedJob);
-          
-          if (updatedJob.status === 'completed' || updatedJob.status === 'failed') {
-            setIsPolling(false);
+          const started = Date.now();
+          const result = await apiService.pollJobStatus(activeJobId, etag);
+          if (cancelled) return;
+          etag = result.etag;
+          if (result.job) {
+            setCurrentJob(result.job);
+            if (result.job.status === 'completed' || result.job.status === 'failed') break;
+          }
+          const elapsed = Date.now() - started;
+          if (elapsed < JOB_POLL_INTERVAL_MS) {
+            await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL_MS - elapsed));
           }
         } catch (error) {
           console.error('Error polling job status:', error);
-          setIsPolling(false);
+          break;
         }
-      }, 2000);
-    }
+      }
+      setIsPolling(false);
+    };
+    poll();
 
     return () => {
-      if (interval) clearInterval(interval);
+      cancelled = true;
       setIsPolling(false);
     };
-  }, [currentJob]);
+  }, [activeJobId]);
 
   const handleFileSelect = (file: File) => {
     setSelectedFile(file);
     setError(null);
+    // Background removal and face detection don't depend on the country, so start them right away
+    analysisRef.current = apiService.analyzePhoto(file)
+      .then(response => response.analysis_id)
+      .catch(() => null);
   };
 
   const handleCountrySelect = (country: Country) => {
@@ -82,7 +108,8 @@ const App: React.FC = () => {
       setError(null);
 
       try {
-        const response = await apiService.uploadPhoto(selectedFile, selectedCountry.id);
+        const analysisId = analysisRef.current ? await analysisRef.current : null;
+        const response = await apiService.uploadPhoto(selectedFile, selectedCountry.id, analysisId);
         
         const job = await apiService.getJobStatus(response.job_id);
         setCurrentJob(job);
@@ -99,7 +126,8 @@ const App: React.FC = () => {
       setError(null);
 
       try {
-        const prepareResult = await apiService.preparePhoto(selectedFile, selectedCountry.id);
+        const analysisId = analysisRef.current ? await analysisRef.current : null;
+        const prepareResult = await apiService.preparePhoto(selectedFile, selectedCountry.id, analysisId);
         setPrepareData(prepareResult);
       } catch (error: any) {
         console.error('Prepare error:', error);
@@ -113,6 +141,7 @@ const App: React.FC = () => {
   const handleStartOver = () => {
     setCurrentJob(null);
     setSelectedFile(null);
+    analysisRef.current = null;
     setSelectedCountry(null);
     setError(null);
     setPrepareData(null);
@@ -1,6 +1,6 @@
 import React, { useState, useRef, useEffect, useCallback } from 'react';
 import { useTranslation } from 'react-i18next';
-import { PrepareResponse, SelectionArea, GenerateResponse } from '../types';
+import { PrepareResponse, SelectionArea, GenerateResponse, CountrySelection } from '../types';
 import { apiService } from '../services/api';
 
 interface PhotoEditorProps {
@@ -13,6 +13,13 @@ const PhotoEditor: React.FC<PhotoEditorProps> = ({ prepareData, onPhotoGenerated
   const { t } = useTranslation();
   const canvasRef = useRef<HTMLCanvasElement>(null);
   const [selection, setSelection] = useState<SelectionArea>(prepareData.default_selection);
+  const [activeCountry, setActiveCountry] = useState<CountrySelection>(
+    prepareData.country_selections.find(option => option.country.id === prepareData.country.id) || {
+      country: prepareData.country,
+      target_dimensions: prepareData.target_dimensions,
+      default_selection: prepareData.default_selection,
+    }
+  );
   const [isDragging, setIsDragging] = useState(false);
   const [isResizing, setIsResizing] = useState(false);
   const [dragStart, setDragStart] = useState({ x: 0, y: 0 });
@@ -58,8 +65,7 @@ const PhotoEditor: React.FC<PhotoEditorProps> = ({ prepareData, onPhotoGenerated
       drawCanvas();
     };
 
-    const imageData = `data:image/${prepareData.image_format.toLowerCase()};base64,${prepareData.image_data}`;
-    image.src = imageData;
+    image.src = prepareData.image_url;
   }, [prepareData]);
 
   const drawCanvas = useCallback(() => {
@@ -224,7 +230,7 @@ const PhotoEditor: React.FC<PhotoEditorProps> = ({ prepareData, onPhotoGenerated
       }
 
       // Maintain aspect ratio
-      const targetAspectRatio = prepareData.target_dimensions.width / prepareData.target_dimensions.height;
+      const targetAspectRatio = activeCountry.target_dimensions.width / activeCountry.target_dimensions.height;
       
       if (newSelection.width / newSelection.height > targetAspectRatio) {
         newSelection.width = newSelection.height * targetAspectRatio;
@@ -281,18 +287,27 @@ const PhotoEditor: React.FC<PhotoEditorProps> = ({ prepareData, onPhotoGenerated
     setResizeHandle(null);
   };
 
+  // Every country's default rectangle came with the prepare response, so switching needs no request
+  const handleCountryChange = (countryId: number) => {
+    const option = prepareData.country_selections.find(candidate => candidate.country.id === countryId);
+    if (!option) return;
+    setActiveCountry(option);
+    setSelection(option.default_selection);
+  };
+
   const handleGenerate = async () => {
     setIsGenerating(true);
     try {
       const result = await apiService.generatePhoto(
-        prepareData.image_data,
+        prepareData.token,
         selection,
-        prepareData.country.id
+        activeCountry.country.id
       );
       onPhotoGenerated(result);
     } catch (error: any) {
       console.error('Generate error:', error);
       setErrorMessage(
+        error?.response?.data?.error ||
         error?.response?.data?.message ||
         error?.message ||
         t('editor.generateError', 'An error occurred while generating the photo. Please try again.')
@@ -342,8 +357,26 @@ const PhotoEditor: React.FC<PhotoEditorProps> = ({ prepareData, onPhotoGenerated
                   {t('editor.instructions', 'Background removed automatically. Drag to move, resize from corners.')}
                 </p>
                 <div className="flex items-center gap-4 text-sm text-gray-500">
-                  <span>Target: {prepareData.target_dimensions.width}×{prepareData.target_dimensions.height}px</span>
-                  <span>Country: {prepareData.country.name}</span>
+                  <span>Target: {activeCountry.target_dimensions.width}×{activeCountry.target_dimensions.height}px</span>
+                  {prepareData.country_selections.length > 1 ? (
+                    <label className="flex items-center gap-2">
+                      {t('editor.country', 'Country')}:
+                      <select
+                        value={activeCountry.country.id}
+                        onChange={(e) => handleCountryChange(Number(e.target.value))}
+                        disabled={isGenerating}
+                        className="border border-gray-300 rounded-md px-2 py-1 text-gray-700"
+                      >
+                        {prepareData.country_selections.map(option => (
+                          <option key={option.country.id} value={option.country.id}>
+                            {option.country.name}
+                          </option>
+                        ))}
+                      </select>
+                    </label>
+                  ) : (
+                    <span>Country: {activeCountry.country.name}</span>
+                  )}
                 </div>
               </div>
               
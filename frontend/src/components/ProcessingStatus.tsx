@@ -44,9 +44,13 @@ const ProcessingStatus: React.FC<ProcessingStatusProps> = ({ job, onDownload, on
   const getStatusMessage = () => {
     switch (job.status) {
       case 'pending':
-        return t('processing.pending');
+        return job.queue_position
+          ? t('processing.queuePosition', { position: job.queue_position })
+          : t('processing.pending');
       case 'processing':
-        return t('processing.processing');
+        return job.stage
+          ? t(`processing.stages.${job.stage}`)
+          : t('processing.processing');
       case 'completed':
         return t('processing.completed');
       case 'failed':
@@ -1,8 +1,14 @@
 import axios from 'axios';
-import { Country, PhotoProcessingJob, UploadResponse, PrepareResponse, GenerateResponse, SelectionArea } from '../types';
+import { Country, PhotoProcessingJob, UploadResponse, AnalyzeResponse, PrepareResponse, GenerateResponse, SelectionArea } from '../types';
 
 const API_BASE_URL = process.env.REACT_APP_API_URL || 'http://localhost:8000/api/v1';
 
+// How long preparePhoto keeps retrying while a speculative analysis is still running
+const ANALYSIS_WAIT_MS = 120000;
+
+// Hold asked of a job status poll; servers only hold when JOB_STATUS_MAX_WAIT_SECONDS allows it
+const JOB_STATUS_WAIT_SECONDS = 10;
+
 const api = axios.create({
   baseURL: API_BASE_URL,
   headers: {
@@ -18,9 +24,13 @@ export const apiService = {
   },
 
   // Upload photo (original auto mode)
-  uploadPhoto: async (photo: File, countryId: number): Promise<UploadResponse> => {
+  uploadPhoto: async (photo: File, countryId: number, analysisId?: string | null): Promise<UploadResponse> => {
     const formData = new FormData();
-    formData.append('photo', photo);
+    if (analysisId) {
+      formData.append('analysis_id', analysisId);
+    } else {
+      formData.append('photo', photo);
+    }
     formData.append('country_id', countryId.toString());
 
     const response = await api.post('/upload/', formData, {
@@ -31,13 +41,12 @@ export const apiService = {
     return response.data;
   },
 
-  // Prepare photo for manual selection (semi-auto mode)
-  preparePhoto: async (photo: File, countryId: number): Promise<PrepareResponse> => {
+  // Start background removal and face detection before the country is chosen
+  analyzePhoto: async (photo: File): Promise<AnalyzeResponse> => {
     const formData = new FormData();
     formData.append('photo', photo);
-    formData.append('country_id', countryId.toString());
 
-    const response = await api.post('/prepare/', formData, {
+    const response = await api.post('/analyze/', formData, {
       headers: {
         'Content-Type': 'multipart/form-data',
       },
@@ -45,16 +54,59 @@ export const apiService = {
     return response.data;
   },
 
+  // Prepare photo for manual selection (semi-auto mode); an analysis ID replaces the photo upload
+  preparePhoto: async (photo: File, countryId: number, analysisId?: string | null): Promise<PrepareResponse> => {
+    const formData = new FormData();
+    if (analysisId) {
+      formData.append('analysis_id', analysisId);
+    } else {
+      formData.append('photo', photo);
+    }
+    formData.append('country_id', countryId.toString());
+
+    // The analysis runs in a worker; until it finishes the server answers 503 with a Retry-After
+    const deadline = Date.now() + ANALYSIS_WAIT_MS;
+    for (;;) {
+      try {
+        const response = await api.post('/prepare/', formData, {
+          headers: {
+            'Content-Type': 'multipart/form-data',
+          },
+        });
+        return response.data;
+      } catch (error: any) {
+        if (!analysisId || error.response?.status !== 503 || Date.now() >= deadline) {
+          throw error;
+        }
+        const retryAfter = Number(error.response.headers['retry-after']) || 1;
+        await new Promise(resolve => setTimeout(resolve, retryAfter * 1000));
+      }
+    }
+  },
+
   // Generate final photo from selection
-  generatePhoto: async (imageData: string, selection: SelectionArea, countryId: number): Promise<GenerateResponse> => {
+  generatePhoto: async (token: string, selection: SelectionArea, countryId: number): Promise<GenerateResponse> => {
     const response = await api.post('/generate/', {
-      image_data: imageData,
+      token,
       selection,
       country_id: countryId,
     });
     return response.data;
   },
 
+  // Conditional poll for a job: job is null (a 304) while it still matches etag
+  pollJobStatus: async (jobId: string, etag: string | null): Promise<{ job: PhotoProcessingJob | null; etag: string | null }> => {
+    const response = await api.get(`/job/${jobId}/`, {
+      params: { wait: JOB_STATUS_WAIT_SECONDS },
+      headers: etag ? { 'If-None-Match': etag } : {},
+      validateStatus: status => status === 200 || status === 304,
+    });
+    if (response.status === 304) {
+      return { job: null, etag };
+    }
+    return { job: response.data, etag: response.headers['etag'] || null };
+  },
+
   // Get job status
   getJobStatus: async (jobId: string): Promise<PhotoProcessingJob> => {
     const response = await api.get(`/job/${jobId}/`);
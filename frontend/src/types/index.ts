@@ -9,17 +9,21 @@ export interface Country {
 
 export interface PhotoProcessingJob {
   id: string;
+  kind?: 'render' | 'analysis';
   country: Country;
   status: 'pending' | 'processing' | 'completed' | 'failed';
+  stage?: '' | 'decoded' | 'background_removed' | 'face_detected' | 'rendered';
   error_message?: string;
   created_at: string;
   updated_at: string;
   processed_photo_url?: string;
+  queue_position?: number | null;
 }
 
 export interface UploadResponse {
   job_id: string;
   status: string;
+  queue_position?: number;
   message: string;
 }
 
@@ -30,13 +34,38 @@ export interface SelectionArea {
   height: number;
 }
 
+export interface AnalyzeResponse {
+  analysis_id: string;
+  status: string;
+  queue_position?: number | null;
+}
+
+export interface CountrySelection {
+  country: {
+    id: number;
+    name: string;
+    code: string;
+  };
+  target_dimensions: {
+    width: number;
+    height: number;
+  };
+  default_selection: SelectionArea;
+}
+
 export interface PrepareResponse {
-  image_data: string;
+  token: string;
+  image_url: string;
   image_format: string;
   image_dimensions: {
     width: number;
     height: number;
   };
+  source_dimensions: {
+    width: number;
+    height: number;
+  };
+  preview_scale: number;
   face_bbox: [number, number, number, number];
   default_selection: SelectionArea;
   target_dimensions: {
@@ -48,6 +77,7 @@ export interface PrepareResponse {
     name: string;
     code: string;
   };
+  country_selections: CountrySelection[];
 }
 
 export interface GenerateResponse {
@@ -48,7 +48,9 @@ def test_birefnet_e2e():
             print(f"   - Image dimensions: {prepare_result['image_dimensions']}")
             print(f"   - Face bbox: {prepare_result['face_bbox']}")
             print(f"   - Default selection: {prepare_result['default_selection']}")
-            print(f"   - Image data length: {len(prepare_result['image_data'])}")
+            print(f"   - Token: {prepare_result['token']}")
+            print(f"   - Image URL: {prepare_result['image_url']}")
+            print(f"   - Preview scale: {prepare_result['preview_scale']}")
         else:
             print(f"❌ Prepare failed: {response.status_code}")
             print(f"   Response: {response.text}")
@@ -61,7 +63,7 @@ def test_birefnet_e2e():
     print(f"\n3️⃣ Testing /generate/ with BiRefNet result...")
     
     generate_data = {
-        'image_data': prepare_result['image_data'],
+        'token': prepare_result['token'],
         'selection': prepare_result['default_selection'],
         'country_id': finland['id']
     }
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import time
+import django
+
+# Setup Django
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ai_tools.settings')
+django.setup()
+
+from passport_photo.services import PassportPhotoProcessor
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+MIN_IOU = 0.9  # Boxes this similar give visually identical positioning
+
+def bbox_iou(a, b):
+    ix1, iy1 = max(a[0], b[0]), max(a[1], b[1])
+    ix2, iy2 = min(a[2], b[2]), min(a[3], b[3])
+    intersection = max(0, ix2 - ix1) * max(0, iy2 - iy1)
+    area_a = (a[2] - a[0]) * (a[3] - a[1])
+    area_b = (b[2] - b[0]) * (b[3] - b[1])
+    union = area_a + area_b - intersection
+    return intersection / union if union else 0.0
+
+def test_concurrent_pipeline(corpus_dir):
+    print("🔍 Comparing sequential vs concurrent face detection")
+    print("=" * 60)
+
+    if not os.path.isdir(corpus_dir):
+        print(f"❌ Corpus directory not found: {corpus_dir}")
+        return False
+
+    image_paths = sorted(
+        os.path.join(corpus_dir, name) for name in os.listdir(corpus_dir)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    if not image_paths:
+        print(f"❌ No images found in {corpus_dir}")
+        return False
+
+    print(f"📁 Using {len(image_paths)} images from: {corpus_dir}")
+
+    processor = PassportPhotoProcessor()
+    mismatches = 0
+    sequential_total = 0.0
+    concurrent_total = 0.0
+
+    for path in image_paths:
+        name = os.path.basename(path)
+        with open(path, 'rb') as f:
+            image = processor.load_image(f.read())
+
+        try:
+            start_time = time.time()
+            sequential = processor._analyze_sequential(image)
+            sequential_time = time.time() - start_time
+
+            start_time = time.time()
+            concurrent = processor._analyze_concurrent(image)
+            concurrent_time = time.time() - start_time
+        except Exception as e:
+            print(f"⚠️ {name}: skipped ({e})")
+            continue
+
+        sequential_total += sequential_time
+        concurrent_total += concurrent_time
+
+        seq_face = sequential['face']
+        con_face = concurrent['face']
+        iou = bbox_iou(seq_face['bbox'], con_face['bbox'])
+        matched = iou >= MIN_IOU and seq_face['method'] == con_face['method']
+        if not matched:
+            mismatches += 1
+
+        print(f"{'✅' if matched else '❌'} {name}: IoU {iou:.3f} | "
+              f"sequential {seq_face['bbox']} ({seq_face['method']}, {sequential_time:.2f}s) | "
+              f"concurrent {con_face['bbox']} ({con_face['method']}, {concurrent_time:.2f}s)")
+
+    print(f"\n⏱️ Total time: sequential {sequential_total:.2f}s, concurrent {concurrent_total:.2f}s")
+    if mismatches:
+        print(f"❌ {mismatches} image(s) differ by more than IoU {MIN_IOU}")
+        return False
+
+    print("🎉 All bounding boxes match the sequential path!")
+    return True
+
+if __name__ == "__main__":
+    default_corpus = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "tmp"))
+    corpus = sys.argv[1] if len(sys.argv) > 1 else default_corpus
+    sys.exit(0 if test_concurrent_pipeline(corpus) else 1)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import sys
+import tempfile
+import django
+
+# Setup Django
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ai_tools.settings')
+django.setup()
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment
+from PIL import Image
+from passport_photo.models import Country, PhotoProcessingJob, PhotoOutput
+from passport_photo.country_cache import get_country_cache
+
+# Maximum number of SQL queries per request; none of them may grow with the number of rows
+QUERY_BUDGETS = {
+    'countries (cold cache)': 2,
+    'countries (cached)': 0,
+    'job status (pending)': 3,
+    'job status (completed)': 2,
+    'job status (multi-country)': 3,
+    'job status (not modified)': 1,
+    'upload': 3,
+    'upload multi': 6,  # Includes the BEGIN and COMMIT of the job-and-outputs transaction
+    'admin job list': 8,
+}
+ADMIN_ROWS = (1, 25)  # The admin list must cost the same for both page sizes
+
+def make_photo():
+    buffer = io.BytesIO()
+    Image.new('RGB', (800, 1000), (200, 180, 160)).save(buffer, format='JPEG')
+    return SimpleUploadedFile('photo.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+def count_queries(request):
+    with CaptureQueriesContext(connection) as context:
+        response = request()
+    return len(context), response
+
+def test_query_budget():
+    print("🔍 Checking per-endpoint query budgets")
+    print("=" * 60)
+
+    countries = [
+        Country.objects.create(name=name, code=code, photo_width=500, photo_height=653)
+        for name, code in (('Finland', 'FI'), ('Sweden', 'SE'), ('Norway', 'NO'))
+    ]
+    client = Client()
+    api = '/api/v1'
+    measured = {}
+
+    # Countries: the serialized list lives in the process, so only a cold cache reaches the database
+    get_country_cache().invalidate()
+    measured['countries (cold cache)'], _ = count_queries(lambda: client.get(f'{api}/countries/'))
+    measured['countries (cached)'], _ = count_queries(lambda: client.get(f'{api}/countries/'))
+
+    # Uploads stay pending: with the database queue backend nothing picks them up here
+    measured['upload'], response = count_queries(
+        lambda: client.post(f'{api}/upload/', {'photo': make_photo(), 'country_id': countries[0].id})
+    )
+    pending_id = response.json()['job_id']
+    measured['upload multi'], _ = count_queries(
+        lambda: client.post(f'{api}/upload/multi/', {
+            'photo': make_photo(),
+            'country_ids': [country.id for country in countries],
+        })
+    )
+
+    measured['job status (pending)'], _ = count_queries(lambda: client.get(f'{api}/job/{pending_id}/'))
+
+    completed = PhotoProcessingJob.objects.create(country=countries[0], original_photo='x.jpg', status='completed')
+    measured['job status (completed)'], response = count_queries(lambda: client.get(f'{api}/job/{completed.id}/'))
+    measured['job status (not modified)'], _ = count_queries(
+        lambda: client.get(f'{api}/job/{completed.id}/', HTTP_IF_NONE_MATCH=response['ETag'])
+    )
+
+    multi = PhotoProcessingJob.objects.create(country=countries[0], original_photo='x.jpg', status='completed')
+    PhotoOutput.objects.bulk_create([PhotoOutput(job=multi, country=country) for country in countries])
+    measured['job status (multi-country)'], _ = count_queries(lambda: client.get(f'{api}/job/{multi.id}/'))
+
+    # Admin changelist: same query count whatever the number of rows on the page
+    admin_client = Client()
+    admin_client.force_login(User.objects.create_superuser('budget', 'budget@example.com', 'budget'))
+    admin_counts = []
+    for rows in ADMIN_ROWS:
+        PhotoProcessingJob.objects.all().delete()
+        PhotoProcessingJob.objects.bulk_create([
+            PhotoProcessingJob(country=countries[index % len(countries)], original_photo='x.jpg',
+                               expires_at=completed.expires_at)
+            for index in range(rows)
+        ])
+        count, _ = count_queries(lambda: admin_client.get('/admin/passport_photo/photoprocessingjob/'))
+        admin_counts.append(count)
+    measured['admin job list'] = max(admin_counts)
+
+    failures = 0
+    for name, budget in QUERY_BUDGETS.items():
+        count = measured[name]
+        ok = count <= budget
+        failures += not ok
+        print(f"{'✅' if ok else '❌'} {name}: {count} queries (budget {budget})")
+
+    if len(set(admin_counts)) > 1:
+        failures += 1
+        print(f"❌ Admin job list queries grow with rows: {dict(zip(ADMIN_ROWS, admin_counts))}")
+
+    if failures:
+        print(f"\n❌ {failures} endpoint(s) over budget")
+        return False
+
+    print("\n🎉 All endpoints within their query budgets!")
+    return True
+
+if __name__ == "__main__":
+    setup_test_environment()
+    settings.PASSPORT_PHOTO_SETTINGS['JOB_QUEUE']['BACKEND'] = 'database'
+
+    # Runs against a throwaway test database and media directory, never the development data
+    with tempfile.TemporaryDirectory() as media_root:
+        settings.MEDIA_ROOT = media_root
+        old_name = connection.creation.create_test_db(verbosity=0)
+        try:
+            passed = test_query_budget()
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+    sys.exit(0 if passed else 1)
@@ -5,8 +5,11 @@ import sys
 import time
 import django
 
-# Setup Django
+# Setup Django; the mask cache would turn repeated timings into cache hits, and the uniform-backdrop
+# shortcut would skip the model being measured
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ai_tools.settings')
+os.environ['MASK_CACHE_ENABLED'] = 'False'
+os.environ['UNIFORM_BACKDROP_ENABLED'] = 'False'
 django.setup()
 
 from passport_photo.services import PassportPhotoProcessor